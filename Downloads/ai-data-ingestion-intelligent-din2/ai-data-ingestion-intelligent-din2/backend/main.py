@@ -15,7 +15,7 @@ from pydantic import BaseModel
 from .services.logger import append_log, read_logs
 from .services.rag import answer_question
 
-from .services.vector_store import reset_vector_store_cache
+from .services.vector_store import reset_vector_store_cache, warmup_vector_store
 
 
 # -----------------------------------------------------------
@@ -42,6 +42,12 @@ UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 
+@app.on_event("startup")
+def warmup():
+    # โหลด Vector DB + Embedding model ไว้ก่อน request แรก
+    warmup_vector_store()
+
+
 # -----------------------------------------------------------
 # Helper: ID Normalization (CRITICAL FIX)
 # -----------------------------------------------------------
@@ -10,7 +10,7 @@ from backend.services.chunking import (
     table_items_to_chunks,
     text_items_to_chunks,
 )
-from backend.services.vector_store import index_chunks, search_similar
+from backend.services.vector_store import flush_vector_store, index_chunks, search_similar
 
 
 # -------------------------------------------------------------------
@@ -184,6 +184,7 @@ def main():
 
     # 4) index chunks ทั้งหมดเข้า Chroma
     index_chunks(all_chunks)
+    flush_vector_store()
     print("\nIndexed all chunks into Chroma.")
 
     # 5) ทดลอง search เบื้องต้น (ถ้ามี doc_id ที่ ingest สำเร็จ)
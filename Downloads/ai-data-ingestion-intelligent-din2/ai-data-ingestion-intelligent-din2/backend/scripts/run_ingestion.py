@@ -10,7 +10,7 @@ from ingestion.pdf_parser import parse_pdf
 from ingestion.document_classifier import classify_document
 from ingestion.table_extractor import extract_tables
 from ingestion.image_extractor import extract_images
-from ingestion.schema import IngestedDocument, TextBlock
+from ingestion.schema import IngestedDocument, TextBlock, dumps
 from ingestion.validator import validate_all
 from ingestion.ocr_extractor import ocr_extract_document
 
@@ -159,17 +159,10 @@ def run_ingestion_pipeline(
     image_path = doc_dir / "image.json"
     validation_path = doc_dir / "validation.json"
 
-    with metadata_path.open("w", encoding="utf-8") as f:
-        json.dump(doc.metadata.to_dict(), f, ensure_ascii=False, indent=2)
-
-    with text_path.open("w", encoding="utf-8") as f:
-        json.dump([t.to_dict() for t in doc.texts], f, ensure_ascii=False, indent=2)
-
-    with table_path.open("w", encoding="utf-8") as f:
-        json.dump([tb.to_dict() for tb in doc.tables], f, ensure_ascii=False, indent=2)
-
-    with image_path.open("w", encoding="utf-8") as f:
-        json.dump([im.to_dict() for im in doc.images], f, ensure_ascii=False, indent=2)
+    metadata_path.write_bytes(dumps(doc.metadata, indent=True))
+    text_path.write_bytes(dumps([t.to_dict() for t in doc.texts], indent=True))
+    table_path.write_bytes(dumps([tb.to_dict() for tb in doc.tables], indent=True))
+    image_path.write_bytes(dumps([im.to_dict() for im in doc.images], indent=True))
 
     with validation_path.open("w", encoding="utf-8") as f:
         json.dump(issues, f, ensure_ascii=False, indent=2)
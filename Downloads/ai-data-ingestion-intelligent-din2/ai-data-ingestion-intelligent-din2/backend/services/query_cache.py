@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+_QUERY_CACHE_MAX_SIZE = 256
+# cosine similarity ขั้นต่ำที่ถือว่าเป็น "คำถามเดียวกัน" (embedding ถูก normalize แล้ว -> dot = cosine)
+_SEMANTIC_HIT_THRESHOLD = 0.97
+
+# key: (normalized_query, frozenset(doc_ids), top_k, mode)
+CacheKey = Tuple[str, FrozenSet[str], int, str]
+
+# value: {"result": dict คำตอบ, "embedding": np.ndarray | None}
+_query_cache: "OrderedDict[CacheKey, Dict[str, Any]]" = OrderedDict()
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _to_unit_vector(embedding: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+    if embedding is None:
+        return None
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        return None
+    return vec / norm
+
+
+def make_cache_key(query: str, doc_ids: Optional[Iterable[str]], top_k: int, mode: str) -> CacheKey:
+    return (_normalize_query(query), frozenset(doc_ids or ()), top_k, mode)
+
+
+def get_cached_answer(key: CacheKey, embedding: Optional[Sequence[float]] = None) -> Optional[Dict]:
+    """
+    หาคำตอบที่เคยตอบไปแล้ว
+    1) Exact: query ที่ normalize แล้วตรงกันทุกตัวอักษร
+    2) Semantic: ถ้าส่ง embedding มา จะเทียบ cosine กับ query อื่นที่ใช้ doc_ids/top_k/mode เดียวกัน
+    คืน shallow copy เพื่อไม่ให้ caller แก้ค่าใน cache
+    """
+    entry = _query_cache.get(key)
+    if entry is not None:
+        _query_cache.move_to_end(key)
+        return dict(entry["result"])
+
+    query_vec = _to_unit_vector(embedding)
+    if query_vec is None:
+        return None
+
+    scope = key[1:]
+    best_key: Optional[CacheKey] = None
+    best_score = _SEMANTIC_HIT_THRESHOLD
+    for cached_key, cached in _query_cache.items():
+        cached_vec = cached["embedding"]
+        if cached_vec is None or cached_key[1:] != scope:
+            continue
+        score = float(np.dot(cached_vec, query_vec))
+        if score >= best_score:
+            best_score = score
+            best_key = cached_key
+
+    if best_key is None:
+        return None
+
+    _query_cache.move_to_end(best_key)
+    return dict(_query_cache[best_key]["result"])
+
+
+def put_cached_answer(key: CacheKey, result: Dict, embedding: Optional[Sequence[float]] = None) -> None:
+    _query_cache[key] = {"result": dict(result), "embedding": _to_unit_vector(embedding)}
+    _query_cache.move_to_end(key)
+    while len(_query_cache) > _QUERY_CACHE_MAX_SIZE:
+        _query_cache.popitem(last=False)
+
+
+def clear_query_cache() -> None:
+    """ล้าง cache ทั้งหมด (เรียกตอนข้อมูลใน Vector DB เปลี่ยน เช่น upload เอกสารใหม่)"""
+    _query_cache.clear()
@@ -1,22 +1,28 @@
 from __future__ import annotations
 
+import io
 import os
+import heapq
 import re
+import asyncio
 import json
 import logging
 import math
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
 from difflib import SequenceMatcher
+from functools import lru_cache
 
 from dotenv import load_dotenv
 
 # [CHANGE] เปลี่ยน Import เป็น ChatOpenAI สำหรับ Custom API
 try:
+    import httpx
     from langchain_openai import ChatOpenAI
     from langchain_core.messages import HumanMessage, SystemMessage
     _HAS_GENAI = True
 except Exception:
+    httpx = None  # type: ignore
     ChatOpenAI = None  # type: ignore
     HumanMessage = None  # type: ignore
     SystemMessage = None  # type: ignore
@@ -31,7 +37,16 @@ except ImportError:
     _HAS_RERANKER = False
     _RERANK_MODEL = None
 
-from .vector_store import search_similar
+# --- Fuzzy prefilter (optional) ---
+try:
+    from rapidfuzz import fuzz, process as rf_process
+    _HAS_RAPIDFUZZ = True
+except ImportError:
+    _HAS_RAPIDFUZZ = False
+
+from .embeddings import embed_query
+from .query_cache import get_cached_answer, make_cache_key, put_cached_answer
+from .vector_store import search_similar, sanitize_doc_id  # ใช้ตัวเดียวกับตอน index เพื่อให้ doc_id ตรงกันเสมอ
 
 try:
     from langchain_google_genai import ChatGoogleGenerativeAI
@@ -46,8 +61,7 @@ logger = logging.getLogger(__name__)
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 INGESTED_DIR = PROJECT_ROOT / "ingested"
 
-_QNA_CACHE: Dict[str, List[Dict[str, str]]] = {}
-_QNA_CACHE_MAX_SIZE = 100
+_QNA_CACHE_MAX_SIZE = 256
 
 # load .env to make sure key available
 load_dotenv(override=True)
@@ -55,6 +69,7 @@ load_dotenv(override=True)
 
 _CUSTOM_API_KEY = os.getenv("CUSTOM_API_KEY")
 _CUSTOM_API_BASE = os.getenv("CUSTOM_API_BASE")
+_GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # [CHANGE] กำหนด Model เป็น Qwen ตามที่ต้องการ
 _LL_MODEL_FAST = os.getenv("CUSTOM_MODEL_NAME", "qwen/qwen-2.5-72b-instruct")
@@ -63,6 +78,12 @@ _LL_MODEL_SMALL = _LL_MODEL_FAST
 
 _DEFAULT_TEMPERATURE = 0.1 # ลด Temperature ลงเพื่อลดการมั่ว
 
+# Hedged request: ถ้า Primary LLM ยังไม่ตอบภายใน N ms ให้ยิง Gemini คู่ขนาน (0 = ปิด, ไม่เปลือง quota)
+try:
+    _LLM_HEDGE_MS = int(os.getenv("LLM_HEDGE_MS", "0") or 0)
+except ValueError:
+    _LLM_HEDGE_MS = 0
+
 # Re-ranking config
 _RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
@@ -87,6 +108,13 @@ _QNA_PATTERN = re.compile(
     re.IGNORECASE | re.DOTALL,
 )
 
+# Table placeholder regex (ที่ LLM ตอบกลับมา เช่น [SHOW_TABLE:TBL_1], [SHOW_TABLE:CAT=สรุป])
+# group 1 = ชื่อหมวด (CAT=...), group 2 = เลขตาราง (TBL_1 / 1 / 1.2)
+_SHOW_TABLE_PATTERN = re.compile(
+    r"\[(?:SHOW_TABLE|SHOW|TABLE)[^:]*:\s*(?:CAT\s*=\s*([^\]]+)|(?:TBL[_]?)?\s*([\d\.]+))\]",
+    re.IGNORECASE,
+)
+
 # Normalize Score Function
 def normalize_score(raw_score: float) -> float:
     try:
@@ -96,48 +124,40 @@ def normalize_score(raw_score: float) -> float:
 
 
 # -------------------------------------------------------------------
-# [NEW FIX] Sanitize Document ID (ให้ตรงกับ Backend)
+# Helper: Sanitization
 # -------------------------------------------------------------------
-def sanitize_doc_id(doc_id: str) -> str:
-    """
-    Sanitize document ID to match backend storage format.
-    """
-    if not doc_id:
-        return ""
-    # Lowercase
-    doc_id = doc_id.lower().strip()
-    # Replace spaces with underscores
-    doc_id = re.sub(r'\s+', '_', doc_id)
-    
-    # [CHANGE] แก้บรรทัดนี้: เพิ่ม \u0E00-\u0E7F (ช่วงรหัสภาษาไทย) ลงไปในข้อยกเว้น
-    # จากเดิม: doc_id = re.sub(r'[^a-z0-9_]', '', doc_id)
-    doc_id = re.sub(r'[^a-z0-9_\u0E00-\u0E7F-]', '', doc_id) 
-    
-    return doc_id
+# รวม 3 pattern เป็น regex เดียว สแกน HTML รอบเดียว แล้วเลือกคำแทนตาม group ที่ match
+_HTML_SANITIZE_PATTERN = re.compile(
+    r"(?P<script><script.*?>.*?</script>)|(?P<event> on\w+=)|(?P<js>javascript:)",
+    re.IGNORECASE | re.DOTALL,
+)
+_HTML_SANITIZE_REPLACEMENTS = {"script": "", "event": " data-blocked-event=", "js": "blocked:"}
 
 
-# -------------------------------------------------------------------
-# Helper: Sanitization
-# -------------------------------------------------------------------
 def _sanitize_html_content(html: str) -> str:
     if not html: return ""
-    html = re.sub(r"<script.*?>.*?</script>", "", html, flags=re.IGNORECASE | re.DOTALL)
-    html = re.sub(r" on\w+=", " data-blocked-event=", html, flags=re.IGNORECASE)
-    html = re.sub(r"javascript:", "blocked:", html, flags=re.IGNORECASE)
-    return html
+    return _HTML_SANITIZE_PATTERN.sub(lambda m: _HTML_SANITIZE_REPLACEMENTS[m.lastgroup], html)
 
 
 # -------------------------------------------------------------------
 # Helper: LLM (Custom/OpenAI Compatible) safe getter
 # -------------------------------------------------------------------
+# instance ถูก cache ไว้ทั้ง process เพื่อ reuse connection pool (keep-alive) ข้าม request
+# หมายเหตุ: ถ้าเปลี่ยน API key ใน .env ต้อง restart process
+@lru_cache(maxsize=1)
+def _get_http_async_client():
+    return httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=32))
+
+
+@lru_cache(maxsize=8)
 def _get_llm_instance(model: Optional[str] = None, temperature: float = _DEFAULT_TEMPERATURE):
     if not _HAS_GENAI:
         logger.debug("[rag] langchain_openai not installed -> no LLM available")
         return None
     
-    # [CHANGE] รับค่า Key และ Base URL จาก Env ใหม่
-    api_key = os.getenv("CUSTOM_API_KEY") or _CUSTOM_API_KEY
-    api_base = os.getenv("CUSTOM_API_BASE") or _CUSTOM_API_BASE
+    # [CHANGE] ใช้ Key และ Base URL ที่โหลดจาก Env ตอน import
+    api_key = _CUSTOM_API_KEY
+    api_base = _CUSTOM_API_BASE
     
     if not api_key:
         logger.debug("[rag] CUSTOM_API_KEY not set -> no LLM available")
@@ -152,7 +172,8 @@ def _get_llm_instance(model: Optional[str] = None, temperature: float = _DEFAULT
             openai_api_key=api_key,
             openai_api_base=api_base,
             max_retries=2,
-            request_timeout=60 # เพิ่ม timeout เผื่อโมเดลใหญ่ตอบช้า
+            request_timeout=60, # เพิ่ม timeout เผื่อโมเดลใหญ่ตอบช้า
+            http_async_client=_get_http_async_client(),
             # max_tokens=150 # เพิ่มเพื่อรองรับคำตอบยาวขึ้น
         )
     except Exception as e:
@@ -162,9 +183,10 @@ def _get_llm_instance(model: Optional[str] = None, temperature: float = _DEFAULT
 
 # backend/services/rag.py
 
+@lru_cache(maxsize=1)
 def _get_google_llm():
     """สร้าง Google Gemini Instance เป็นแผนสำรอง"""
-    api_key = os.getenv("GOOGLE_API_KEY")
+    api_key = _GOOGLE_API_KEY
     if not api_key or not ChatGoogleGenerativeAI:
         return None
     
@@ -202,14 +224,30 @@ def _get_reranker_model():
 # [NEW] Intent & Logic Guards (เพิ่มส่วนนี้)
 # -------------------------------------------------------------------
 
+_TABLE_KEYWORDS = frozenset({"ตาราง", "table", "คอลัมน์", "column", "แถว", "row", "สรุป", "summary", "ยอด", "amount", "list", "รายการ", "schedule"})
+_IMAGE_KEYWORDS = frozenset({"รูป", "รูปภาพ", "image", "logo", "กราฟ", "graph", "chart", "diagram", "photo", "ภาพ"})
+_AUTO_TABLE_KEYWORDS = frozenset({"ตาราง", "table", "ยอด", "สถิติ", "list", "รายการ", "สรุป"})
+_GENERAL_KEYWORDS = frozenset({"สวัสดี", "hello", "hi", "วันนี้วันอะไร", "อากาศ", "who are you", "คุณคือใคร", "สบายดีไหม"})
+# ตัด Stopwords ทั่วไปออก
+_STOPWORDS = frozenset({"คือ", "เป็น", "อยู่", "จะ", "ได้", "ที่", "ซึ่ง", "อัน", "ของ", "what", "is", "are", "the", "a", "an", "ครับ", "ค่ะ"})
+
+
+def _keyword_pattern(keywords) -> re.Pattern:
+    # ภาษาไทยไม่มีช่องว่างระหว่างคำ จึงต้องเช็คแบบ substring: รวมเป็น regex เดียวสแกนรอบเดียว
+    return re.compile("|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
+
+_TABLE_KEYWORDS_RE = _keyword_pattern(_TABLE_KEYWORDS)
+_IMAGE_KEYWORDS_RE = _keyword_pattern(_IMAGE_KEYWORDS)
+_AUTO_TABLE_KEYWORDS_RE = _keyword_pattern(_AUTO_TABLE_KEYWORDS)
+
+
 def _rule_based_intent(query: str) -> Optional[str]:
     # (ฟังก์ชันเดิม เก็บไว้ใช้เป็น Helper แต่ logic หลักย้ายไป auto mode selector)
     if not query or not query.strip(): return None
     q = query.lower()
-    table_keywords = ["ตาราง", "table", "คอลัมน์", "column", "แถว", "row", "สรุป", "summary", "ยอด", "amount", "list", "รายการ", "schedule"]
-    image_keywords = ["รูป", "รูปภาพ", "image", "logo", "กราฟ", "graph", "chart", "diagram", "photo", "ภาพ"]
-    is_table = any(w in q for w in table_keywords)
-    is_image = any(w in q for w in image_keywords)
+    is_table = _TABLE_KEYWORDS_RE.search(q) is not None
+    is_image = _IMAGE_KEYWORDS_RE.search(q) is not None
     if is_table and not is_image: return "table"
     if is_image and not is_table: return "both"
     if is_table and is_image: return "both"
@@ -218,8 +256,7 @@ def _rule_based_intent(query: str) -> Optional[str]:
 def _detect_general_intent(query: str) -> bool:
     """ตรวจสอบว่าเป็นคำถามทั่วไปที่ไม่เกี่ยวกับเอกสารหรือไม่"""
     q = query.lower().strip()
-    general_keywords = ["สวัสดี", "hello", "hi", "วันนี้วันอะไร", "อากาศ", "who are you", "คุณคือใคร", "สบายดีไหม"]
-    if q in general_keywords:
+    if q in _GENERAL_KEYWORDS:
         return True
     # เช็คคำถามเรื่องเวลา/วันที่แบบเจาะจง
     if "วันนี้" in q and "วันอะไร" in q:
@@ -232,14 +269,10 @@ def _keyword_overlap_count(query: str, text: str) -> int:
     q_clean = re.sub(r'[^\w\s]', '', query).lower()
     t_clean = re.sub(r'[^\w\s]', '', text).lower()
     
-    q_tokens = set(q_clean.split())
-    t_tokens = set(t_clean.split())
-    
-    # ตัด Stopwords ทั่วไปออก
-    stopwords = {"คือ", "เป็น", "อยู่", "จะ", "ได้", "ที่", "ซึ่ง", "อัน", "ของ", "what", "is", "are", "the", "a", "an", "ครับ", "ค่ะ"}
-    q_tokens = q_tokens - stopwords
-    
+    q_tokens = set(q_clean.split()) - _STOPWORDS
     if not q_tokens: return 0
+
+    t_tokens = set(t_clean.split())
     return len(q_tokens.intersection(t_tokens))
 
 def _filter_relevant_docs(query: str, docs: list, min_score: float = MIN_SCORE_THRESHOLD) -> list:
@@ -270,33 +303,54 @@ def _filter_relevant_docs(query: str, docs: list, min_score: float = MIN_SCORE_T
 # -------------------------------------------------------------------
 # 3) Build context text
 # -------------------------------------------------------------------
-def _build_context_text(docs) -> str:
-    parts: List[str] = []
-    total_tokens = 0
-    # MAX_TOKENS_ESTIMATE = 12000
-    # [🔥 แก้ตรงนี้] ลดจาก 12000 เหลือ 4000
-    MAX_TOKENS_ESTIMATE = 4000
+_CONTEXT_HEADER = "⚠️ **แหล่งข้อมูลอ้างอิง:** (เรียงตามความเกี่ยวข้อง)\n"
 
-    parts.append("⚠️ **แหล่งข้อมูลอ้างอิง:** (เรียงตามความเกี่ยวข้อง)\n")
 
+def _iter_context(docs, budget: Optional[int] = None, slice_len: int = 3000) -> Iterator[Tuple[int, str, Dict]]:
+    """
+    Yield (ลำดับ, เนื้อหาที่ตัดแล้ว, metadata) ของแต่ละ doc โดยตัด content แค่ครั้งเดียว
+    - budget: จำนวนตัวอักษรรวมสูงสุด (None = ไม่จำกัด)
+    """
+    remaining = budget
     for i, d in enumerate(docs, 1):
         content = getattr(d, "page_content", "") or getattr(d, "content", "") or ""
-        content = content.replace("\x00", "") 
-        
-        if len(content) + total_tokens > MAX_TOKENS_ESTIMATE:
-            break
+        content = content.replace("\x00", "")[:slice_len]
 
-        md = d.metadata or {}
+        if remaining is not None and len(content) > remaining:
+            return
+
+        yield i, content, d.metadata or {}
+
+        if remaining is not None:
+            remaining -= len(content)
+            if remaining <= 0:
+                return
+
+
+def _build_context_text(docs) -> str:
+    # MAX_TOKENS_ESTIMATE = 12000
+    # [🔥 แก้ตรงนี้] ลดจาก 12000 เหลือ 4000 (นับเป็นจำนวนตัวอักษร ไม่ใช่ token จริง)
+    MAX_TOKENS_ESTIMATE = 4000
+
+    buf = io.StringIO()
+    buf.write(_CONTEXT_HEADER)
+
+    for i, content, md in _iter_context(docs, budget=MAX_TOKENS_ESTIMATE, slice_len=3000):
         doc_id = md.get("doc_id", "unknown")
         page = md.get("page", "?")
         score = md.get("ai_score", 0.0)
-        
-        header = (f"[SOURCE {i}] ID: {doc_id} | Page: {page} | Score: {score:.2f}")
-        parts.append(f"{header}\n{content[:3000]}")
-        total_tokens += len(content[:3000])
 
-    joined = "\n\n".join(parts)
-    return joined
+        buf.write(f"\n\n[SOURCE {i}] ID: {doc_id} | Page: {page} | Score: {score:.2f}\n")
+        buf.write(content)
+
+    return buf.getvalue()
+
+
+# -------------------------------------------------------------------
+# Helper: Wrap table HTML for chat display
+# -------------------------------------------------------------------
+def _wrap_table_html(html: str) -> str:
+    return f"\n<div class='my-4 overflow-x-auto border rounded-lg shadow-sm bg-white p-2'>{html}</div>\n"
 
 
 # -------------------------------------------------------------------
@@ -331,8 +385,9 @@ def _filter_table_docs_by_category(docs, query: str):
 # [UPDATED] Advanced Re-ranking Logic (Smarter)
 # -------------------------------------------------------------------
 def _clean_text_for_rerank(text: str) -> str:
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text[:1000]
+    # split/join ทั้งข้อความ (C-level เร็วกว่า regex ผลเท่ากัน) แล้วค่อยตัด
+    # ห้ามตัดก่อนยุบช่องว่าง: ข้อความที่ขึ้นต้นด้วย space ยาว ๆ (ตารางที่ pad มา) จะเหลือแค่ไม่กี่ตัว
+    return " ".join(text.split())[:1000]
 
 def _rerank_documents(query: str, docs: list, top_k: int) -> list:
     if not docs:
@@ -365,8 +420,17 @@ def _rerank_documents(query: str, docs: list, top_k: int) -> list:
         try:
             valid_pairs_indices = []
             pairs = []
+
+            # Two-stage: ส่งเข้า Cross Encoder เฉพาะตัวที่มี keyword ตรง + อันดับต้นๆ จาก vector search
+            # (docs มาเรียงตาม similarity อยู่แล้ว) ที่เหลือคง ai_score เดิมไว้และจะตกไปท้ายลิสต์
+            rerank_budget = max(top_k * 2, 12)
+            candidate_indices = sorted(
+                range(len(scored_docs)),
+                key=lambda i: (scored_docs[i].metadata["keyword_score"] == 0, i),
+            )[:rerank_budget]
             
-            for i, doc in enumerate(scored_docs):
+            for i in candidate_indices:
+                doc = scored_docs[i]
                 clean_content = _clean_text_for_rerank(doc.page_content)
                 if clean_content:
                     pairs.append([query, clean_content])
@@ -400,39 +464,61 @@ def _rerank_documents(query: str, docs: list, top_k: int) -> list:
 # -------------------------------------------------------------------
 # 4) Q&A extraction + matching utilities
 # -------------------------------------------------------------------
-def _load_qna_pairs_for_doc(doc_id: str) -> List[Dict[str, str]]:
-    if len(_QNA_CACHE) > _QNA_CACHE_MAX_SIZE:
-        _QNA_CACHE.clear()
-
-    if doc_id in _QNA_CACHE:
-        return _QNA_CACHE[doc_id]
-
+@lru_cache(maxsize=_QNA_CACHE_MAX_SIZE)
+def _load_qna_cached(doc_id: str, mtime_ns: int) -> Tuple[Tuple[str, str], ...]:
+    # mtime_ns เป็นส่วนหนึ่งของ key: ถ้า text.json ถูกเขียนใหม่ cache จะถูก bypass อัตโนมัติ
     path = INGESTED_DIR / doc_id / "text.json"
-    if not path.exists():
-        _QNA_CACHE[doc_id] = []
-        return []
-
     try:
         raw = json.loads(path.read_text(encoding="utf-8"))
     except Exception:
-        _QNA_CACHE[doc_id] = []
-        return []
+        return ()
 
     full = "\n".join((item.get("content") or "") for item in raw)
-    pairs: List[Dict[str, str]] = []
+    pairs: List[Tuple[str, str]] = []
     for m in _QNA_PATTERN.finditer(full):
         q = " ".join(m.group("q").split())
         a = " ".join(m.group("a").split())
         if q and a:
-            pairs.append({"question": q, "answer": a})
-    _QNA_CACHE[doc_id] = pairs
-    return pairs
+            pairs.append((q, a))
+    return tuple(pairs)
+
+
+def _load_qna_pairs_for_doc(doc_id: str) -> List[Dict[str, str]]:
+    path = INGESTED_DIR / doc_id / "text.json"
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return []
+
+    return [{"question": q, "answer": a} for q, a in _load_qna_cached(doc_id, mtime_ns)]
 
 
 def _simple_similarity(a: str, b: str) -> float:
     return SequenceMatcher(None, a, b).ratio()
 
 
+_QNA_RERANK_CANDIDATES = 50
+
+
+def _prefilter_qna_pairs(query: str, all_pairs: List[Dict], limit: int = _QNA_RERANK_CANDIDATES) -> List[Dict]:
+    """คัด Q&A ที่คำถามใกล้เคียง query แบบถูกๆ ก่อน เพื่อลดจำนวนคู่ที่ต้องส่งเข้า Cross Encoder"""
+    if len(all_pairs) <= limit:
+        return all_pairs
+
+    questions = [p["question"] for p in all_pairs]
+    if _HAS_RAPIDFUZZ:
+        top = rf_process.extract(query, questions, scorer=fuzz.token_set_ratio, limit=limit)
+        return [all_pairs[idx] for _, _, idx in top]
+
+    # Fallback: quick_ratio เป็น upper bound ของ SequenceMatcher.ratio() ที่คำนวณเร็วกว่ามาก
+    matcher = SequenceMatcher(None, "", query)
+    scores = []
+    for i, q in enumerate(questions):
+        matcher.set_seq1(q)
+        scores.append((matcher.quick_ratio(), i))
+    return [all_pairs[i] for _, i in heapq.nlargest(limit, scores)]
+
+
 def _find_best_qna_answer_from_docs(query: str, docs) -> Optional[Dict]:
     qna_doc_ids = sorted({
         (d.metadata or {}).get("doc_id")
@@ -459,14 +545,15 @@ def _find_best_qna_answer_from_docs(query: str, docs) -> Optional[Dict]:
     reranker = _get_reranker_model()
     if reranker:
         try:
-            input_pairs = [[query, p["question"]] for p in all_pairs]
+            candidates = _prefilter_qna_pairs(query, all_pairs)
+            input_pairs = [[query, p["question"]] for p in candidates]
             raw_scores = reranker.predict(input_pairs)
             
             for i, raw in enumerate(raw_scores):
                 norm_score = normalize_score(float(raw))
                 if norm_score > best_score:
                     best_score = norm_score
-                    best_item = all_pairs[i]
+                    best_item = candidates[i]
         except Exception:
             pass
 
@@ -486,6 +573,46 @@ def _find_best_qna_answer_from_docs(query: str, docs) -> Optional[Dict]:
     return None
 
 
+# -------------------------------------------------------------------
+# Helper: Hedged LLM call (Primary + Backup แข่งกัน)
+# -------------------------------------------------------------------
+async def _invoke_llm(llm, messages) -> str:
+    ai_response = await llm.ainvoke(messages)
+    return getattr(ai_response, "content", str(ai_response))
+
+
+async def _hedged_llm_answer(primary_llm, backup_llm, messages, hedge_delay: float) -> str:
+    """
+    ยิง Primary ก่อน ถ้าเกิน hedge_delay วินาทียังไม่เสร็จ (หรือพังไปแล้ว) ให้ยิง Backup คู่ขนาน
+    แล้วใช้คำตอบแรกที่สำเร็จ ส่วน task ที่แพ้จะถูก cancel ทิ้ง
+    """
+    primary_task = asyncio.create_task(_invoke_llm(primary_llm, messages))
+    tasks = {primary_task: "primary"}
+    done, pending = await asyncio.wait({primary_task}, timeout=hedge_delay)
+
+    try:
+        while True:
+            for task in done:
+                if task.exception() is not None:
+                    logger.warning(f"[rag] ❌ {tasks[task]} LLM failed: {task.exception()}")
+                    continue
+                answer_text = task.result()
+                if answer_text and answer_text != "AI Error":
+                    logger.info(f"[rag] Hedged LLM answered by {tasks[task]}")
+                    return answer_text
+            if len(tasks) == 1:
+                # Primary ช้าเกิน hedge_delay หรือพังไปแล้ว -> ยิง Backup
+                backup_task = asyncio.create_task(_invoke_llm(backup_llm, messages))
+                tasks[backup_task] = "backup"
+                pending.add(backup_task)
+            if not pending:
+                return ""
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 # -------------------------------------------------------------------
 # 5) main RAG function (UPGRADED & ROBUST)
 # -------------------------------------------------------------------
@@ -512,7 +639,7 @@ async def answer_question(
     # [NEW] STEP 2: Mode Selection (Deterministic)
     if mode == "auto":
         q_lower = query.lower()
-        if any(x in q_lower for x in ["ตาราง", "table", "ยอด", "สถิติ", "list", "รายการ", "สรุป"]):
+        if _AUTO_TABLE_KEYWORDS_RE.search(q_lower):
             intent = "table"
         else:
             intent = "text"
@@ -524,6 +651,24 @@ async def answer_question(
     if doc_ids:
         sanitized_doc_ids = [sanitize_doc_id(doc_id) for doc_id in doc_ids if doc_id]
 
+    # [NEW] Answer Cache: คำถามซ้ำ/ใกล้เคียงมาก (ในเอกสารชุดเดิม) ไม่ต้องค้น + เรียก LLM ใหม่
+    cache_key = make_cache_key(query, sanitized_doc_ids, top_k, mode)
+    cached = get_cached_answer(cache_key)
+    if cached is not None:
+        logger.info("[rag] Answer cache hit (exact)")
+        return cached
+
+    query_embedding = None
+    try:
+        query_embedding = embed_query(query)
+    except Exception as e:
+        logger.warning(f"[rag] Query embedding failed, semantic cache disabled: {e}")
+
+    cached = get_cached_answer(cache_key, query_embedding)
+    if cached is not None:
+        logger.info("[rag] Answer cache hit (semantic)")
+        return cached
+
     doc_types = None
     sources_filter = None 
 
@@ -533,7 +678,7 @@ async def answer_question(
 
     try:
         # Layer 1: Strict Search
-        raw_docs = search_similar(query, k=top_k*3, doc_ids=sanitized_doc_ids, sources=sources_filter, doc_types=doc_types)
+        raw_docs = search_similar(query, k=top_k*3, doc_ids=sanitized_doc_ids, sources=sources_filter, doc_types=doc_types, query_embedding=query_embedding)
         
         # [CHANGE] Disabled Layer 2 & 3 to prevent cross-document contamination
         # ถ้า Layer 1 (Strict) ไม่เจอ ก็คือไม่เจอเลย (เพื่อให้ระบบตอบว่า "ไม่พบข้อมูล" แทนที่จะมั่ว)
@@ -588,25 +733,22 @@ async def answer_question(
         return {"answer": f"ระบบค้นหาขัดข้อง: {str(e)}", "sources": [], "intent": intent, "mode": mode}
 
 # --- Prepare Context & Table Map (FIXED) ---
-    table_map = {}
-    table_cat_map = {}
-    context_parts = [] # เก็บเนื้อหาทีละส่วนเพื่อรวมเป็น Context ใหญ่
+    # key: "tbl:<n>" / "cat:<category>" / "role:<role>" -> HTML ที่ห่อ <div> พร้อมแสดงผลแล้ว
+    table_map: Dict[str, str] = {}
+    context_buf = io.StringIO() # เก็บเนื้อหาทีละส่วนเพื่อรวมเป็น Context ใหญ่
     table_counter = 0 
     
     # [NEW] เก็บรายการ ID ของตารางที่เจอใน Search Result เอาไว้ใช้กรณี AI ไม่ยอมตอบ (Fail-safe)
     found_table_ids = []
     
     try:
-        context_parts.append("⚠️ **แหล่งข้อมูลอ้างอิง:** (เรียงตามความเกี่ยวข้อง)\n")
+        context_buf.write(_CONTEXT_HEADER)
 
-        for i, d in enumerate(docs, 1):
-            md = d.metadata or {}
+        # ดึงเนื้อหา (Markdown) ที่ตัดความยาวแล้วมาเตรียมไว้
+        for i, content, md in _iter_context(docs, slice_len=3500):
             doc_id = md.get("doc_id", "unknown")
             page = md.get("page", "?")
             source = str(md.get("source", "text")).lower().strip()
-            # ดึงเนื้อหา (Markdown) มาเตรียมไว้
-            content = getattr(d, "page_content", "") or ""
-            content = content.replace("\x00", "")
             
             # สร้างส่วนหัวของ Chunk นี้
             chunk_header = f"[SOURCE {i}] ID: {doc_id} | Page: {page}"
@@ -625,7 +767,8 @@ async def answer_question(
                     # Fallback ถ้าไม่มี HTML ให้แสดง Markdown ในกล่องแทน
                     safe_html = f"<pre class='text-xs overflow-auto p-2 bg-gray-100'>{md.get('markdown_content', 'No content')}</pre>"
                 
-                table_map[table_ref_id] = safe_html
+                wrapped_html = _wrap_table_html(safe_html)
+                table_map[f"tbl:{table_ref_id}"] = wrapped_html
                 
                 # 2. [CRITICAL FIX] แปะป้ายบอก AI ชัดๆ ว่าตารางนี้คือรหัสอะไร
                 # AI จะได้รู้ว่า Markdown ข้างล่างนี้ คือ TBL_1
@@ -636,17 +779,15 @@ async def answer_question(
                 role = md.get("role", "").strip().lower()
                 
                 if category:
-                    cat_key = f"cat:{category}"
-                    if cat_key not in table_cat_map: table_cat_map[cat_key] = safe_html
+                    table_map.setdefault(f"cat:{category}", wrapped_html)
                 if role:
-                    role_key = f"role:{role}"
-                    if role_key not in table_cat_map: table_cat_map[role_key] = safe_html
+                    table_map.setdefault(f"role:{role}", wrapped_html)
             
-            # เพิ่มเนื้อหาลงใน Context Parts
-            context_parts.append(f"{chunk_header}\n{content[:3500]}")
+            # เพิ่มเนื้อหาลงใน Context
+            context_buf.write(f"\n\n{chunk_header}\n{content}")
 
         # รวมทุกส่วนเป็นข้อความเดียวส่งให้ AI
-        context_text = "\n\n".join(context_parts)
+        context_text = context_buf.getvalue()
 
     except Exception as e:
         logger.error(f"[rag] Context build failed: {e}")
@@ -697,32 +838,41 @@ async def answer_question(
     # 4) Call LLM (Chain of Fallback: OpenRouter -> Google -> Raw)
     # -------------------------------------------------------------------
     llm = _get_llm_instance(model=_LL_MODEL_FAST)
+    messages = [SystemMessage(content=system_prompt), HumanMessage(content=query)] if _HAS_GENAI else []
     
     answer_text = ""
     ai_response = None
-    
-    # --- 1. แผน A: ลองใช้ Primary LLM (OpenRouter/Qwen) ---
-    try:
-        if llm:
-            # logger.info(f"[rag] 🚀 Trying Primary LLM ({_LL_MODEL_FAST})...")
-            ai_response = await llm.ainvoke([SystemMessage(content=system_prompt), HumanMessage(content=query)])
-            answer_text = getattr(ai_response, "content", str(ai_response))
-    except Exception as e:
-        logger.warning(f"[rag] ❌ Primary LLM failed: {e}")
 
-    # --- 2. แผน B: ถ้าแผน A พัง ให้ลองใช้ Google Gemini (Backup) ---
-    if not answer_text or answer_text == "AI Error":
+    # --- แผน A+B แบบ Hedged (เปิดด้วย LLM_HEDGE_MS) ---
+    hedge_llm = _get_google_llm() if (llm and _LLM_HEDGE_MS > 0) else None
+    if hedge_llm:
+        answer_text = await _hedged_llm_answer(llm, hedge_llm, messages, _LLM_HEDGE_MS / 1000.0)
+    else:
+        # --- 1. แผน A: ลองใช้ Primary LLM (OpenRouter/Qwen) ---
         try:
-            google_llm = _get_google_llm() # เรียกฟังก์ชันที่เราสร้างไว้
-            if google_llm:
-                logger.info("[rag] 🔄 Switching to Backup LLM: Google Gemini...")
-                # ใช้ ainvoke เพื่อให้ทำงานแบบ Async ไม่บล็อกระบบ
-                ai_response = await google_llm.ainvoke([SystemMessage(content=system_prompt), HumanMessage(content=query)])
+            if llm:
+                # logger.info(f"[rag] 🚀 Trying Primary LLM ({_LL_MODEL_FAST})...")
+                ai_response = await llm.ainvoke(messages)
                 answer_text = getattr(ai_response, "content", str(ai_response))
-            else:
-                logger.warning("[rag] Google API Key not found, skipping backup.")
-        except Exception as e_google:
-             logger.error(f"[rag] ❌ Google LLM also failed: {e_google}")
+        except Exception as e:
+            logger.warning(f"[rag] ❌ Primary LLM failed: {e}")
+
+        # --- 2. แผน B: ถ้าแผน A พัง ให้ลองใช้ Google Gemini (Backup) ---
+        if not answer_text or answer_text == "AI Error":
+            try:
+                google_llm = _get_google_llm() # เรียกฟังก์ชันที่เราสร้างไว้
+                if google_llm:
+                    logger.info("[rag] 🔄 Switching to Backup LLM: Google Gemini...")
+                    # ใช้ ainvoke เพื่อให้ทำงานแบบ Async ไม่บล็อกระบบ
+                    ai_response = await google_llm.ainvoke(messages)
+                    answer_text = getattr(ai_response, "content", str(ai_response))
+                else:
+                    logger.warning("[rag] Google API Key not found, skipping backup.")
+            except Exception as e_google:
+                 logger.error(f"[rag] ❌ Google LLM also failed: {e_google}")
+
+    # cache เฉพาะคำตอบที่ LLM ตอบได้จริง (ไม่ cache "AI Error" / placeholder ว่างของโหมด table ตอน LLM ล่ม)
+    llm_succeeded = bool(answer_text) and answer_text != "AI Error"
 
     # --- 3. แผน C (สุดท้าย): ถ้า Google ก็พังอีก (หรือโหมด Table บังคับ) ---
     # ถ้ายังไม่ได้คำตอบ หรือ ได้คำตอบว่างเปล่า
@@ -743,37 +893,27 @@ async def answer_question(
              }
 
     # --- 5) Regex Replacement ---
-    if (table_map or table_cat_map) and answer_text:
+    if table_map and answer_text and "[" in answer_text:
         try:
-            pattern_cat = re.compile(r"\[(?:SHOW_TABLE|SHOW|TABLE)[^:]*:\s*CAT\s*=\s*([^\]]+)\]", re.IGNORECASE)
-            
-            def replace_cat(match):
-                cat_name = match.group(1).strip().lower()
-                cat_key = f"cat:{cat_name}"
-                if cat_key in table_cat_map: return f"\n<div class='my-4 overflow-x-auto border rounded-lg shadow-sm bg-white p-2'>{table_cat_map[cat_key]}</div>\n"
-                role_key = f"role:{cat_name}"
-                if role_key in table_cat_map: return f"\n<div class='my-4 overflow-x-auto border rounded-lg shadow-sm bg-white p-2'>{table_cat_map[role_key]}</div>\n"
-                return match.group(0)
-            
-            answer_text = pattern_cat.sub(replace_cat, answer_text)
-            
-            def replace_match(match):
-                found_id = match.group(1)
+            def replace_table(match):
+                cat_name, found_id = match.group(1), match.group(2)
+                if cat_name is not None:
+                    cat_name = cat_name.strip().lower()
+                    return table_map.get(f"cat:{cat_name}") or table_map.get(f"role:{cat_name}") or match.group(0)
+
                 # Handle TBL_1 format vs 1
                 clean_id = found_id.replace("TBL_", "").strip()
                 
-                if clean_id in table_map: return f"\n<div class='my-4 overflow-x-auto border rounded-lg shadow-sm bg-white p-2'>{table_map[clean_id]}</div>\n"
+                if f"tbl:{clean_id}" in table_map: return table_map[f"tbl:{clean_id}"]
                 
                 if "." in found_id:
                     simple_id = found_id.split(".")[0]
-                    if simple_id in table_map: return f"\n<div class='my-4 overflow-x-auto border rounded-lg shadow-sm bg-white p-2'>{table_map[simple_id]}</div>\n"
-                if len(table_map) == 1:
-                    first_key = list(table_map.keys())[0]
-                    return f"\n<div class='my-4 overflow-x-auto border rounded-lg shadow-sm bg-white p-2'>{table_map[first_key]}</div>\n"
+                    if f"tbl:{simple_id}" in table_map: return table_map[f"tbl:{simple_id}"]
+                if len(found_table_ids) == 1:
+                    return table_map[f"tbl:{found_table_ids[0]}"]
                 return match.group(0)
 
-            pattern = re.compile(r"\[(?:SHOW_TABLE|SHOW|TABLE)[^:]*:\s*(?:TBL[_]?)?\s*([\d\.]+)\]", re.IGNORECASE)
-            answer_text = pattern.sub(replace_match, answer_text)
+            answer_text = _SHOW_TABLE_PATTERN.sub(replace_table, answer_text)
             
         except Exception as e:
             logger.error(f"[rag] Regex replacement failed: {e}")
@@ -789,4 +929,7 @@ async def answer_question(
             "chunk_id": md.get("chunk_id")
         })
 
-    return {"answer": answer_text, "sources": sources, "intent": intent, "mode": f"{mode}+qna_llm"}
\ No newline at end of file
+    result = {"answer": answer_text, "sources": sources, "intent": intent, "mode": f"{mode}+qna_llm"}
+    if llm_succeeded:
+        put_cached_answer(cache_key, result, query_embedding)
+    return result
\ No newline at end of file
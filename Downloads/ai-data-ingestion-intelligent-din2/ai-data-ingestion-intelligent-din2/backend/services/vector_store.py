@@ -2,10 +2,16 @@ from __future__ import annotations
 
 from pathlib import Path
 from typing import List, Optional, Dict, Tuple
+from functools import lru_cache
+from itertools import islice
 import logging
 import warnings
 import re
-import gc  # [FIX 1] เพิ่ม import gc เพื่อจัดการ Memory/File Lock
+import sqlite3
+import sys
+import threading
+import time
+import gc  # [FIX 1] ใช้ปลด File Lock ที่ค้างตอน retry บน Windows
 
 from fastapi import HTTPException
 from langchain_community.vectorstores import Chroma
@@ -15,6 +21,7 @@ from langchain_core.documents import Document
 
 from .chunking import Chunk
 from .embeddings import get_embedding_client
+from .query_cache import clear_query_cache
 
 
 # -----------------------------------------------------------
@@ -28,36 +35,57 @@ try:
 except Exception:
     ChromaInternalError = Exception
 
+# Error ที่ถือว่า DB พัง/ถูกเปลี่ยนจากภายนอก -> reload client แล้ว retry
+_DB_CORRUPTION_ERRORS = (ChromaInternalError, sqlite3.DatabaseError)
+_DB_CORRUPTION_MSG_RE = re.compile(
+    r"Nothing found on disk|InternalError|segment reader|sqlite|Error finding id",  # [FIX 3] ดัก Error finding id
+    re.IGNORECASE,
+)
+
 # -----------------------------------------------------------
 # Configuration
 # -----------------------------------------------------------
 
 CHROMA_DIR = "chroma_db"
 COLLECTION_NAME = "documents"
+# จำนวน chunks ต่อการ add_texts 1 ครั้ง (ให้ sqlite transaction และ embedding batch ไม่ใหญ่เกินไป)
+INDEX_BATCH_SIZE = 256
+# จำนวน docs สูงสุดที่ดึงมากรองเองใน Python (กรณี Chroma ไม่รองรับ native filter)
+_PYTHON_FILTER_MAX_FETCH = 200
 
-# Cache vectordb ตาม (persist_directory, collection_name)
-_vectordb_cache: Dict[Tuple[str, str], Chroma] = {}
+# Cache vectordb ตาม (persist_directory, collection_name) -> (vectordb, เวลาที่สร้าง)
+# ทุกการอ่าน/เขียนต้องถือ _vectordb_lock (กัน 2 threads สร้าง Chroma ซ้อนกันตอน reload)
+_VECTORDB_CACHE_TTL_SEC = 3600
+_VECTORDB_CACHE_MAX_SIZE = 8
+_vectordb_cache: Dict[Tuple[str, str], Tuple[Chroma, float]] = {}
+_vectordb_lock = threading.RLock()
 
 
 # -----------------------------------------------------------
-# [NEW] Sanitize Document ID (ให้ตรงกับ rag.py)
+# [NEW] Sanitize Document ID (rag.py import ตัวนี้ไปใช้ด้วย)
 # -----------------------------------------------------------
+_DOC_ID_WS_RE = re.compile(r'\s+')
+# [CHANGE] เพิ่ม \u0E00-\u0E7F (ช่วงรหัสภาษาไทย) ลงไปในข้อยกเว้น
+# จากเดิม: r'[^a-z0-9_]'
+_DOC_ID_DISALLOWED_RE = re.compile(r'[^a-z0-9_\u0E00-\u0E7F-]')
+
+
+@lru_cache(maxsize=4096)
+def _sanitize_doc_id_cached(doc_id: str) -> str:
+    # Lowercase
+    doc_id = doc_id.lower().strip()
+    # Replace spaces with underscores
+    doc_id = _DOC_ID_WS_RE.sub('_', doc_id)
+    return _DOC_ID_DISALLOWED_RE.sub('', doc_id)
+
+
 def sanitize_doc_id(doc_id: str) -> str:
     """
     Sanitize document ID to match backend storage format.
     """
     if not doc_id:
         return ""
-    # Lowercase
-    doc_id = doc_id.lower().strip()
-    # Replace spaces with underscores
-    doc_id = re.sub(r'\s+', '_', doc_id)
-    
-    # [CHANGE] แก้บรรทัดนี้: เพิ่ม \u0E00-\u0E7F (ช่วงรหัสภาษาไทย) ลงไปในข้อยกเว้น
-    # จากเดิม: doc_id = re.sub(r'[^a-z0-9_]', '', doc_id)
-    doc_id = re.sub(r'[^a-z0-9_\u0E00-\u0E7F-]', '', doc_id) 
-    
-    return doc_id
+    return _sanitize_doc_id_cached(doc_id)
 
 
 # -----------------------------------------------------------
@@ -68,6 +96,87 @@ def _cache_key(persist_directory: str, collection_name: str) -> Tuple[str, str]:
     return (str(Path(persist_directory).resolve()), collection_name)
 
 
+def _get_cached_vectordb(key: Tuple[str, str]) -> Optional[Chroma]:
+    """อ่าน cache (ต้องถือ _vectordb_lock) ถ้าหมดอายุ TTL จะปิด client แล้วลบทิ้ง คืน None"""
+    entry = _vectordb_cache.get(key)
+    if entry is None:
+        return None
+    vectordb, created_at = entry
+    if time.monotonic() - created_at > _VECTORDB_CACHE_TTL_SEC:
+        _drop_cached_vectordb(key)
+        return None
+    return vectordb
+
+
+def _put_cached_vectordb(key: Tuple[str, str], vectordb: Chroma) -> None:
+    """เขียน cache (ต้องถือ _vectordb_lock) ถ้าเกินขนาดจะปิดแล้วไล่ตัวที่เก่าที่สุดออก"""
+    _vectordb_cache[key] = (vectordb, time.monotonic())
+    while len(_vectordb_cache) > _VECTORDB_CACHE_MAX_SIZE:
+        oldest_key = min(_vectordb_cache, key=lambda k: _vectordb_cache[k][1])
+        _drop_cached_vectordb(oldest_key)
+
+
+def _drop_cached_vectordb(key: Tuple[str, str]) -> None:
+    """
+    ลบ entry เดียวออกจาก cache แล้วปิด client ของมัน (ต้องถือ _vectordb_lock)
+    - client ของ persist_directory เดียวกันใช้ Chroma System ร่วมกัน
+      -> stop เฉพาะเมื่อไม่มี entry อื่นใน cache ใช้ directory นั้นอยู่แล้ว
+    - stop แล้วต้องเอา System ออกจาก shared cache ของ Chroma ด้วย ไม่งั้น client ใหม่จะได้ System ที่ปิดแล้ว
+    """
+    entry = _vectordb_cache.pop(key, None)
+    if entry is None:
+        return
+    if any(other[0] == key[0] for other in _vectordb_cache):
+        return
+
+    vectordb, _ = entry
+    _stop_vectordb(vectordb)
+    client = getattr(vectordb, "_client", None)
+    identifier = getattr(client, "_identifier", None)
+    if identifier is not None:
+        for shared in ("_identifier_to_system", "_identifier_to_refcount"):
+            table = getattr(client, shared, None)
+            if isinstance(table, dict):
+                table.pop(identifier, None)
+
+
+def _stop_vectordb(vectordb: Chroma) -> None:
+    """หยุด System ของ Chroma client (ปิด sqlite/HNSW file handle จริง ๆ)"""
+    client = getattr(vectordb, "_client", None)
+    try:
+        system = getattr(client, "_system", None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        logger.debug(f"[vector_store] Failed to close Chroma client: {e}")
+
+
+def _close_cached_vectordbs() -> None:
+    """
+    ปิด Chroma client ที่อยู่ใน cache ทั้งหมดแล้วล้าง cache (ต้องถือ _vectordb_lock)
+    - stop System ของทุก client ก่อน (clear_system_cache() แค่ล้าง dict identifier→System ไม่ได้ปิด handle)
+    - แล้วค่อย clear_system_cache() ครั้งเดียว ไม่ให้ client ใหม่ได้ System ที่ stop ไปแล้วกลับมาใช้
+    """
+    entries = list(_vectordb_cache.values())
+    _vectordb_cache.clear()
+    clear_system_cache = None
+    for vectordb, _ in entries:
+        _stop_vectordb(vectordb)
+        clear_system_cache = clear_system_cache or getattr(
+            getattr(vectordb, "_client", None), "clear_system_cache", None
+        )
+
+    if callable(clear_system_cache):
+        try:
+            clear_system_cache()  # Chroma >= 0.4 (มีผลทั้ง process)
+        except Exception as e:
+            logger.debug(f"[vector_store] Failed to clear Chroma system cache: {e}")
+
+    # เผื่อ handle ที่ยังค้างอยู่กับ object ที่ไม่มี reference แล้ว (File Lock บน Windows)
+    if entries and sys.platform == "win32":
+        gc.collect()
+
+
 def get_vector_store(
     persist_directory: str = CHROMA_DIR,
     collection_name: str = COLLECTION_NAME,
@@ -84,44 +193,68 @@ def get_vector_store(
     persist_path.mkdir(parents=True, exist_ok=True)
     key = _cache_key(persist_directory, collection_name)
 
-    # [FIX] ถ้าสั่ง Reload ให้ลบ Cache ทิ้งก่อน และสั่ง GC เพื่อปลด File Lock
-    if should_reload and key in _vectordb_cache:
-        logger.info(f"[vector_store] Forcing reload of ChromaDB client for {key}")
-        del _vectordb_cache[key]
-        gc.collect() # [FIX 2] บังคับล้าง Memory ทันที เพื่อแก้ปัญหา File Lock บน Windows
+    with _vectordb_lock:
+        # [FIX] ถ้าสั่ง Reload ให้ปิด client เดิมของ key นี้ทิ้งก่อน เพื่อปลด File Lock
+        # (ปิดเฉพาะ key นี้ ไม่แตะ collection/directory อื่นที่ cache ไว้)
+        # ดู entry ดิบ (ไม่ผ่าน TTL) เพื่อให้ entry ที่หมดอายุแล้วถูกปิดด้วย
+        if should_reload and key in _vectordb_cache:
+            logger.info(f"[vector_store] Forcing reload of ChromaDB client for {key}")
+            _drop_cached_vectordb(key)
+
+        if not force_recreate:
+            cached = _get_cached_vectordb(key)
+            if cached is not None:
+                return cached
+
+        # Embedding client เป็น singleton ระดับ module (embeddings.py) จึงไม่ถูกสร้างใหม่ตอน reload
+        embeddings = get_embedding_client()
 
-    if not force_recreate and key in _vectordb_cache:
-        return _vectordb_cache[key]
+        try:
+            # Suppress deprecation warnings
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                vectordb = Chroma(
+                    collection_name=collection_name,
+                    embedding_function=embeddings,
+                    persist_directory=str(persist_path),
+                )
+        except Exception as e:
+            logger.exception("[vector_store] Failed to init Chroma: %s", e)
+            # Retry เผื่อจังหวะชนกัน (บน Windows ต้อง GC ก่อนเพื่อปลด handle ที่ค้าง)
+            if sys.platform == "win32":
+                gc.collect()
+            try:
+                vectordb = Chroma(
+                    collection_name=collection_name,
+                    embedding_function=embeddings,
+                    persist_directory=str(persist_path),
+                )
+            except Exception:
+                raise HTTPException(
+                    status_code=500,
+                    detail="ไม่สามารถเชื่อมต่อ Vector DB ได้ โปรดตรวจสอบการติดตั้ง"
+                ) from e
+
+        _put_cached_vectordb(key, vectordb)
+        return vectordb
 
-    embeddings = get_embedding_client()
 
+def warmup_vector_store(
+    persist_directory: str = CHROMA_DIR,
+    collection_name: str = COLLECTION_NAME,
+) -> None:
+    """
+    โหลด Chroma client + Embedding model ตั้งแต่ตอน start server
+    เพื่อไม่ให้ผู้ใช้คนแรกต้องรอ cold start (เปิด sqlite, โหลด HNSW, โหลดโมเดล)
+    """
     try:
-        # Suppress deprecation warnings
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            vectordb = Chroma(
-                collection_name=collection_name,
-                embedding_function=embeddings,
-                persist_directory=str(persist_path),
-            )
+        vectordb = get_vector_store(persist_directory, collection_name)
+        # ยิง query หลอก 1 ครั้ง ให้โมเดล embed พร้อม และดึง index เข้า page cache
+        vectordb.similarity_search("warmup", k=1)
+        logger.info("[vector_store] Warmup done.")
     except Exception as e:
-        logger.exception("[vector_store] Failed to init Chroma: %s", e)
-        # ลอง GC อีกรอบแล้ว Retry เผื่อจังหวะชนกัน
-        gc.collect()
-        try:
-            vectordb = Chroma(
-                collection_name=collection_name,
-                embedding_function=embeddings,
-                persist_directory=str(persist_path),
-            )
-        except Exception:
-            raise HTTPException(
-                status_code=500,
-                detail="ไม่สามารถเชื่อมต่อ Vector DB ได้ โปรดตรวจสอบการติดตั้ง"
-            ) from e
+        logger.warning(f"[vector_store] Warmup failed (will retry lazily on first query): {e}")
 
-    _vectordb_cache[key] = vectordb
-    return vectordb
 
 # -----------------------------------------------------------------------------
 # [NEW] ฟังก์ชันล้าง Cache แบบสั่งตาย (Global Reset)
@@ -130,33 +263,35 @@ def reset_vector_store_cache():
     """
     ท่าไม้ตาย: สั่งล้าง Cache ของ Vector DB ทั้งหมดทันที
     ใช้เรียกตอน Upload เสร็จ เพื่อให้ครั้งต่อไประบบต้องโหลด DB ใหม่แน่นอน
+    (ไม่ล้าง Embedding client เพราะ config ไม่เปลี่ยนตาม upload และโหลดโมเดลใหม่ช้ามาก)
     """
     global _vectordb_cache
     
-    if _vectordb_cache:
-        print(f"[vector_store] 🧹 Force clearing {_vectordb_cache} cache entries...")
-        _vectordb_cache.clear()
-    
-    # บังคับ Python คืน RAM และปลด File Lock ทันที (แก้ปัญหา Windows Error)
-    try:
-        import gc
-        gc.collect()
-        print("[vector_store] 🗑️ Garbage collection done.")
-    except Exception as e:
-        print(f"[vector_store] GC Error: {e}")
+    with _vectordb_lock:
+        if _vectordb_cache:
+            print(f"[vector_store] 🧹 Force clearing {len(_vectordb_cache)} cache entries...")
+            _close_cached_vectordbs()
+
+    # ข้อมูลใน DB เปลี่ยนแล้ว คำตอบที่ cache ไว้อาจล้าสมัย
+    clear_query_cache()
+
+_SIMPLE_METADATA_TYPES = (str, int, float, bool, type(None))
+
 
 def _normalize_metadata(md: dict) -> dict:
-    """แปลงค่า complex types เป็น string เพื่อให้ Chroma เก็บได้"""
-    simple: dict = {}
-    for k, v in (md or {}).items():
-        if isinstance(v, (str, int, float, bool)) or v is None:
-            simple[k] = v
-        else:
+    """
+    แปลงค่า complex types เป็น string เพื่อให้ Chroma เก็บได้
+    - แก้ใน dict เดิมเลย (caller ส่ง dict ที่สร้างใหม่มาแล้ว) ไม่ต้องสร้าง dict ชุดที่สอง
+    """
+    if not md:
+        return {}
+    for k, v in md.items():
+        if not isinstance(v, _SIMPLE_METADATA_TYPES):
             try:
-                simple[k] = str(v)
+                md[k] = str(v)
             except Exception:
-                simple[k] = repr(v)
-    return simple
+                md[k] = repr(v)
+    return md
 
 # -----------------------------------------------------------
 # 1) Indexing: เอา chunks ไปเก็บใน Chroma
@@ -171,40 +306,77 @@ def index_chunks(
         return
 
     vectordb = get_vector_store(persist_directory, collection_name)
-    texts = [c.content for c in chunks]
-    
-    # [FIX] Sanitize doc_id ก่อนเก็บ
-    raw_metadatas = [
-        (c.metadata or {}) | {
-            "doc_id": sanitize_doc_id(c.doc_id),  # [CRITICAL FIX]
-            "doc_type": c.doc_type,
-            "source": c.source,
-            "page": c.page,
-            "chunk_id": c.id,
-        } for c in chunks
-    ]
-    
-    metadatas = [_normalize_metadata(md) for md in raw_metadatas]
-    ids = [c.id for c in chunks]
+
+    # doc_type / source ซ้ำกันเกือบทุก chunk -> ใช้ string object เดียวกันแทนการถือสำเนาแยกต่อ chunk
+    # (dict เฉพาะรอบ index นี้ ไม่ใช้ sys.intern ซึ่งค้างอยู่ทั้ง process ใน server ที่รันยาว)
+    interned: Dict[str, str] = {}
+
+    def _intern(value):
+        if not isinstance(value, str):
+            return value
+        return interned.setdefault(value, value)
+
+    # สร้าง texts / metadatas / ids ใน loop เดียว
+    texts: List[str] = []
+    metadatas: List[dict] = []
+    ids: List[str] = []
+    for c in chunks:
+        texts.append(c.content)
+        ids.append(c.id)
+        md = dict(c.metadata or {})
+        md["doc_id"] = sanitize_doc_id(c.doc_id)  # [CRITICAL FIX] Sanitize doc_id ก่อนเก็บ (lru_cache คืน object เดิมอยู่แล้ว)
+        md["doc_type"] = _intern(c.doc_type)
+        md["source"] = _intern(c.source)
+        md["page"] = c.page
+        md["chunk_id"] = c.id
+        metadatas.append(_normalize_metadata(md))
 
     try:
         logger.info(f"[vector_store] Indexing {len(chunks)} chunks...")
-        vectordb.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+        for start in range(0, len(texts), INDEX_BATCH_SIZE):
+            end = start + INDEX_BATCH_SIZE
+            vectordb.add_texts(texts=texts[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
         
-        # [DEBUG] แสดง doc_id ที่เก็บลงไป
-        unique_doc_ids = set(md["doc_id"] for md in raw_metadatas)
-        logger.info(f"[vector_store] Indexed doc_ids: {unique_doc_ids}")
-        
-        try:
-            vectordb.persist()
-        except Exception: 
-            pass
+        # [DEBUG] แสดง doc_id ที่เก็บลงไป (สร้าง set เฉพาะตอนที่ log จะถูกพิมพ์จริง)
+        if logger.isEnabledFor(logging.INFO):
+            unique_doc_ids = {md["doc_id"] for md in metadatas}
+            logger.info(f"[vector_store] Indexed doc_ids: {unique_doc_ids}")
+        # ไม่ persist ตรงนี้: ให้ caller เรียก flush_vector_store() ครั้งเดียวตอนจบงาน ingest
     # [CHANGE] ลบการดักจับ GoogleGenerativeAIError ออก เพื่อให้รองรับ error ทั่วไปหรือ OpenAI error
     except Exception as e:
         logger.exception("[vector_store] Indexing error: %s", e)
         raise HTTPException(status_code=500, detail=f"Indexing error: {e}") from e
 
 
+@lru_cache(maxsize=1)
+def _chroma_auto_persists() -> bool:
+    """Chroma >= 0.4 เขียนลง disk อัตโนมัติ (persist() เป็น no-op / deprecated)"""
+    try:
+        import chromadb
+        major, minor = (int(p) for p in chromadb.__version__.split(".")[:2])
+        return (major, minor) >= (0, 4)
+    except Exception:
+        return False
+
+
+def flush_vector_store(
+    persist_directory: str = CHROMA_DIR,
+    collection_name: str = COLLECTION_NAME,
+) -> None:
+    """
+    Persist Chroma ครั้งเดียวหลังจบงาน ingest (แทนการ persist ทุกครั้งที่ add_texts)
+    """
+    with _vectordb_lock:
+        vectordb = _get_cached_vectordb(_cache_key(persist_directory, collection_name))
+    if vectordb is None or not hasattr(vectordb, "persist") or _chroma_auto_persists():
+        return
+
+    try:
+        vectordb.persist()
+    except Exception as e:
+        logger.warning("[vector_store] Persist failed: %s", e)
+
+
 # -----------------------------------------------------------
 # 2) Search: Pure Retrieval (COMPLETELY REWRITTEN)
 # -----------------------------------------------------------
@@ -213,51 +385,118 @@ def _python_filter_documents(
     raw_docs: List[Document], 
     doc_ids: Optional[List[str]], 
     sources: Optional[List[str]], 
-    doc_types: Optional[List[str]]
+    doc_types: Optional[List[str]],
+    limit: Optional[int] = None,
 ) -> List[Document]:
     """
     [IMPROVED] กรองเอกสารด้วย Python พร้อม Sanitization
+    - limit: หยุดทันทีเมื่อได้ครบจำนวน (ไม่ต้องกรองทั้งลิสต์แล้วค่อย slice)
     """
-    filtered = []
-    
     # [FIX] Sanitize doc_ids ที่ใช้กรอง
+    # ถ้ามี id เดียว (กรณีส่วนใหญ่) เทียบด้วย == ไม่ต้องสร้าง set
+    single_doc_id = None
     sanitized_doc_ids = None
     if doc_ids:
-        sanitized_doc_ids = set(sanitize_doc_id(d) for d in doc_ids)
-    
-    for d in raw_docs:
+        sanitized_doc_ids = {sanitize_doc_id(d) for d in doc_ids}
+        if len(sanitized_doc_ids) == 1:
+            (single_doc_id,) = sanitized_doc_ids
+            sanitized_doc_ids = None
+    sources_set = set(sources) if sources else None
+    doc_types_set = set(doc_types) if doc_types else None
+
+    # [DEBUG] Log metadata ของ document แรก
+    if raw_docs and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[vector_store] Sample metadata: {raw_docs[0].metadata}")
+
+    def _matches(d: Document) -> bool:
         md = d.metadata or {}
-        
-        # [DEBUG] Log metadata ของ document แรก
-        if not filtered:
-            logger.debug(f"[vector_store] Sample metadata: {md}")
-        
+
         # Check doc_ids (WITH SANITIZATION)
-        if sanitized_doc_ids:
+        if single_doc_id is not None or sanitized_doc_ids:
             found_id = md.get("doc_id")
             if not found_id:
-                continue
-            
-            # [FIX] Sanitize ก่อนเปรียบเทียบ
-            normalized_found_id = sanitize_doc_id(str(found_id))
-            if normalized_found_id not in sanitized_doc_ids:
-                continue
+                return False
+
+            # [FIX] Sanitize ก่อนเปรียบเทียบ (table vectors จาก pdf_parser เก็บ doc_id ดิบ ไม่ผ่าน sanitize)
+            found_id = sanitize_doc_id(str(found_id))
+            if single_doc_id is not None:
+                if found_id != single_doc_id:
+                    return False
+            elif found_id not in sanitized_doc_ids:
+                return False
                 
         # Check sources
-        if sources:
+        if sources_set:
             doc_source = md.get("source")
-            if not doc_source or str(doc_source) not in sources:
-                continue
+            if not doc_source or str(doc_source) not in sources_set:
+                return False
             
         # Check doc_types
-        if doc_types:
+        if doc_types_set:
             doc_type = md.get("doc_type")
-            if not doc_type or str(doc_type) not in doc_types:
-                continue
-            
-        filtered.append(d)
-    
-    return filtered
+            if not doc_type or str(doc_type) not in doc_types_set:
+                return False
+
+        return True
+
+    return list(islice(filter(_matches, raw_docs), limit))
+
+
+def _build_where_filter(
+    doc_ids: Optional[List[str]],
+    sources: Optional[List[str]],
+    doc_types: Optional[List[str]],
+) -> Optional[Dict]:
+    """
+    สร้าง Chroma where clause: ค่าเดียวใช้ Equality, หลายค่าใช้ $in, หลาย field รวมด้วย $and
+    คืน None ถ้าไม่มีเงื่อนไขเลย
+    """
+    clauses = []
+    for field, values in (("doc_id", doc_ids), ("source", sources), ("doc_type", doc_types)):
+        if not values:
+            continue
+        values = list(dict.fromkeys(values))
+        if len(values) == 1:
+            clauses.append({field: values[0]})
+        else:
+            clauses.append({field: {"$in": values}})
+
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def _search_with_python_filter(
+    vectordb: Chroma,
+    query_embedding: List[float],
+    k: int,
+    doc_ids: Optional[List[str]],
+    sources: Optional[List[str]],
+    doc_types: Optional[List[str]],
+) -> List[Document]:
+    """
+    ค้นแบบไม่ใส่ filter แล้วกรองใน Python โดยดึงเป็นรอบ ๆ ขนาด k*2, k*4, ...
+    หยุดทันทีที่ได้ครบ k หรือ collection หมด (ไม่ต้องดึง k*10 ทุกครั้งถ้า filter เจอเร็ว)
+    """
+    max_fetch = max(k * 10, _PYTHON_FILTER_MAX_FETCH)
+    fetch_size = min(max(k * 2, 1), max_fetch)
+    while True:
+        raw_docs = vectordb.similarity_search_by_vector(query_embedding, k=fetch_size)
+        results = _python_filter_documents(raw_docs, doc_ids, sources, doc_types, limit=k)
+        if len(results) >= k or len(raw_docs) < fetch_size or fetch_size >= max_fetch:
+            break
+        fetch_size = min(fetch_size * 2, max_fetch)
+
+    logger.info(f"[vector_store] Fetched {len(raw_docs)} raw documents for Python filtering")
+
+    # [DEBUG] แสดง doc_ids ที่ดึงมาได้
+    if raw_docs and logger.isEnabledFor(logging.DEBUG):
+        found_doc_ids = {d.metadata.get("doc_id") for d in raw_docs if d.metadata}
+        logger.debug(f"[vector_store] Available doc_ids in fetched results: {found_doc_ids}")
+
+    return results
 
 
 def search_similar(
@@ -268,9 +507,12 @@ def search_similar(
     doc_ids: Optional[List[str]] = None,
     sources: Optional[List[str]] = None,
     doc_types: Optional[List[str]] = None,
+    query_embedding: Optional[List[float]] = None,
 ) -> List[Document]:
     """
     [COMPLETELY REWRITTEN] ระบบค้นหาแบบ Robust with Smart Fallback
+    - query_embedding: ถ้า caller embed query ไว้แล้ว ส่งมาได้เลย จะไม่ embed ซ้ำ
+      (query ถูก embed แค่ครั้งเดียวแล้วใช้ร่วมกันทุก branch: native / python filter / retry)
     """
     if not query or not query.strip():
         raise HTTPException(status_code=400, detail="Empty query")
@@ -283,62 +525,42 @@ def search_similar(
         sanitized_doc_ids = [sanitize_doc_id(d) for d in doc_ids if d]
         logger.info(f"[vector_store] Original doc_ids: {doc_ids} -> Sanitized: {sanitized_doc_ids}")
 
-    # --- 1. สร้างเงื่อนไขการกรอง (SIMPLIFIED) ---
-    where_filter = {}
-    
-    # [FIX] ใช้ Simple Equality แทน $in สำหรับ Single Value
-    if sanitized_doc_ids:
-        if len(sanitized_doc_ids) == 1:
-            where_filter["doc_id"] = sanitized_doc_ids[0]
-        else:
-            # [FIX] บาง Chroma version ไม่รองรับ $in ให้ลอง OR แทน
-            # แต่ OR ก็ซับซ้อน ดังนั้นถ้ามี multiple IDs ให้ใช้ Python Filter แทน
-            where_filter = None  # Force Python Filter
-            
-    if sources:
-        if len(sources) == 1:
-            if where_filter is not None:
-                where_filter["source"] = sources[0]
-        else:
-            where_filter = None  # Force Python Filter
-            
-    if doc_types:
-        if len(doc_types) == 1:
-            if where_filter is not None:
-                where_filter["doc_type"] = doc_types[0]
-        else:
-            where_filter = None
+    # --- 1. สร้างเงื่อนไขการกรอง (Native: $in / $and) ---
+    where_filter = _build_where_filter(sanitized_doc_ids, sources, doc_types)
 
     # --- 2. Smart Search Strategy ---
     try:
-        # [NEW] Strategy: ถ้า Filter ซับซ้อน (multiple values) ให้ข้าม Native Filter ไปเลย
-        use_native_filter = where_filter is not None and where_filter != {}
-        
-        if use_native_filter:
-            logger.info(f"[vector_store] Using NATIVE filter: {where_filter}")
-            results = vectordb.similarity_search(query, k=k, filter=where_filter)
-            
-            # Check if native filter worked
+        if query_embedding is None:
+            query_embedding = vectordb.embeddings.embed_query(query)
+
+        if where_filter is None:
+            # ไม่มีเงื่อนไขกรอง: ค้นตรงๆ ไม่ต้องดึงมาเผื่อ
+            results = vectordb.similarity_search_by_vector(query_embedding, k=k)
+            logger.info(f"[vector_store] Search query='{query[:50]}...' returned {len(results)} results")
+            return results
+
+        use_native_filter = True
+        logger.info(f"[vector_store] Using NATIVE filter: {where_filter}")
+        try:
+            results = vectordb.similarity_search_by_vector(query_embedding, k=k, filter=where_filter)
+        except ValueError as filter_error:
+            # Chroma รุ่นเก่าที่ไม่รองรับ $in / $and จะ reject where clause
+            logger.warning(f"[vector_store] Native filter rejected ({filter_error}). Switching to Python filter.")
+            use_native_filter = False  # Trigger fallback
+        else:
+            # native filter เทียบ doc_id ตรง ๆ -> vector ที่เก็บ doc_id ไม่ได้ sanitize
+            # (table vectors จาก pdf_parser / chunks รุ่นเก่า) จะไม่เจอ ให้ลอง Python filter ที่ sanitize ฝั่ง metadata
             if not results:
-                logger.warning(f"[vector_store] Native filter returned 0 results. Switching to Python filter.")
-                use_native_filter = False  # Trigger fallback
-        
-        # Fallback to Python Filter
+                logger.warning("[vector_store] Native filter returned 0 results. Switching to Python filter.")
+                use_native_filter = False
+
+        # Fallback to Python Filter (Chroma รุ่นเก่า / native filter ไม่เจออะไร)
         if not use_native_filter:
             logger.info(f"[vector_store] Using PYTHON filter for: doc_ids={sanitized_doc_ids}, sources={sources}, doc_types={doc_types}")
             
-            # [FIX] ดึงมา k*10 แทน k*5 เพื่อเพิ่มโอกาสเจอ
-            fetch_size = max(k * 10, 50)  # อย่างน้อย 50 ตัว
-            raw_docs = vectordb.similarity_search(query, k=fetch_size)
-            
-            logger.info(f"[vector_store] Fetched {len(raw_docs)} raw documents for Python filtering")
-            
-            # [DEBUG] แสดง doc_ids ที่ดึงมาได้
-            if raw_docs:
-                found_doc_ids = set(d.metadata.get("doc_id") for d in raw_docs if d.metadata)
-                logger.info(f"[vector_store] Available doc_ids in fetched results: {found_doc_ids}")
-            
-            results = _python_filter_documents(raw_docs, doc_ids, sources, doc_types)[:k]
+            results = _search_with_python_filter(
+                vectordb, query_embedding, k, sanitized_doc_ids, sources, doc_types
+            )
         
         logger.info(f"[vector_store] Search query='{query[:50]}...' returned {len(results)} results")
         
@@ -350,14 +572,11 @@ def search_similar(
         logger.warning(f"[vector_store] Search Exception: {error_msg}")
 
         is_db_corruption = (
-            "Nothing found on disk" in error_msg 
-            or "InternalError" in error_msg 
-            or "segment reader" in error_msg
-            or "sqlite" in error_msg.lower()
-            or "Error finding id" in error_msg # [FIX 3] ดัก Error finding id
+            isinstance(e, _DB_CORRUPTION_ERRORS)
+            or _DB_CORRUPTION_MSG_RE.search(error_msg) is not None
         )
 
-        if is_db_corruption or isinstance(e, ChromaInternalError):
+        if is_db_corruption:
             logger.warning("[vector_store] 🚨 DB Corruption/Change detected. Reloading Vector Store...")
             
             # 1. Force Reload (ลบ Cache และสร้างใหม่)
@@ -366,8 +585,11 @@ def search_similar(
             # 2. Retry Search with the NEW vectordb instance
             try:
                 # ใช้ Python Filter เพื่อความชัวร์สูงสุด
-                raw_docs = vectordb.similarity_search(query, k=k*10)
-                results = _python_filter_documents(raw_docs, doc_ids, sources, doc_types)[:k]
+                if query_embedding is None:
+                    query_embedding = vectordb.embeddings.embed_query(query)
+                results = _search_with_python_filter(
+                    vectordb, query_embedding, k, sanitized_doc_ids, sources, doc_types
+                )
                 logger.info(f"[vector_store] Retry success. Found {len(results)} results.")
                 return results
             except Exception as final_e:
@@ -390,17 +612,18 @@ def get_collection_info(
     [NEW] Debug function: แสดงข้อมูลใน Collection
     """
     try:
-        # ใช้ reload=True เพื่อให้เห็นข้อมูลล่าสุดเสมอ
-        vectordb = get_vector_store(persist_directory, collection_name, reload=True)
+        # ใช้ client ที่ cache ไว้ (upload ใหม่จะ reset cache ให้อยู่แล้ว)
+        vectordb = get_vector_store(persist_directory, collection_name)
         
-        sample_docs = vectordb.similarity_search("test", k=5)
+        # ดึงเฉพาะ metadata ตรงจาก collection ไม่ต้อง embed query หลอกๆ
+        sample = vectordb.get(limit=100, include=["metadatas"])
+        sample_metadatas = [md or {} for md in (sample.get("metadatas") or [])]
         
         doc_ids = set()
         sources = set()
         doc_types = set()
         
-        for doc in sample_docs:
-            md = doc.metadata or {}
+        for md in sample_metadatas:
             if md.get("doc_id"):
                 doc_ids.add(md.get("doc_id"))
             if md.get("source"):
@@ -410,11 +633,11 @@ def get_collection_info(
         
         return {
             "collection_name": collection_name,
-            "sample_count": len(sample_docs),
+            "sample_count": len(sample_metadatas),
             "unique_doc_ids": list(doc_ids),
             "unique_sources": list(sources),
             "unique_doc_types": list(doc_types),
-            "sample_metadata": [doc.metadata for doc in sample_docs[:3]]
+            "sample_metadata": sample_metadatas[:3]
         }
     except Exception as e:
         logger.exception("[vector_store] Failed to get collection info: %s", e)
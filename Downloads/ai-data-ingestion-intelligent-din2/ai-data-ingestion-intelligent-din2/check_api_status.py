@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import httpx
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -34,10 +35,12 @@ def check_custom_api():
     print("\n🔄 Connecting to Server...", end=" ")
     
     try:
+        # ใช้ httpx.Client ตัวเดียว (keep-alive) ทั้ง List Models และ Chat Completion
         client = OpenAI(
             api_key=api_key,
             base_url=base_url,
-            timeout=10.0 # ตั้ง Timeout 10 วินาที
+            timeout=10.0, # ตั้ง Timeout 10 วินาที
+            http_client=httpx.Client(limits=httpx.Limits(max_keepalive_connections=4)),
         )
         print("✅ Client Initialized.")
     except Exception as e:
@@ -12,25 +12,38 @@ Data Cleaning Engine ขั้นพื้นฐานสำหรับ:
 - เก็บ info เดิมไว้ใน extra.cleaning เผื่อ debug ทีหลัง
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any
 import re
 
+from .config import CLEANER_WORKERS
 from .schema import TextBlock, TableBlock
 
 # -------------------------------------------------------------------
 # Regex / helper พื้นฐาน
 # -------------------------------------------------------------------
 
-# ลบ control chars ทั่วไป (เว้น \t, \n, \r)
-CONTROL_CHAR_RE = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F]")
-# zero width / no-break space ที่ชอบติดมาจาก PDF / OCR
-ZERO_WIDTH_RE = re.compile(r"[\u200B-\u200D\uFEFF]")
-NBSP_RE = re.compile(r"\u00A0")
+# ตาราง str.translate: ลบ control chars ทั่วไป (เว้น \t, \n, \r) + zero width
+# และแปลง no-break space เป็น space ธรรมดา (ที่ชอบติดมาจาก PDF / OCR) ในรอบเดียว
+_CHAR_TRANSLATE: Dict[int, Any] = {c: None for c in range(0x20) if c not in (0x09, 0x0A, 0x0D)}
+_CHAR_TRANSLATE.update({0x200B: None, 0x200C: None, 0x200D: None, 0xFEFF: None, 0x00A0: " "})
+# ตัวที่อยู่ใน _CHAR_TRANSLATE (ข้อความส่วนใหญ่ไม่มีเลย -> search ก่อนถูกกว่า translate ทั้งก้อนมาก)
+NEEDS_TRANSLATE_RE = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F\u200B-\u200D\uFEFF\u00A0]")
 
 # ยุบ whitespace ภายในบรรทัด (เว้น newline)
 INLINE_WS_RE = re.compile(r"[ \t\r\f\v]+")
+# ช่วง space/newline ที่มี newline อย่างน้อย 1 ตัว (ใช้ลบ space รอบ newline + บีบบรรทัดว่างในรอบเดียว)
+NEWLINE_RUN_RE = re.compile(r" *\n[ \n]*")
 # คำที่ถือว่ามี “ตัวอักษรสำคัญ” (อังกฤษ, เลข, ไทย)
 WORD_CHARS_RE = re.compile(r"[A-Za-z0-9\u0E00-\u0E7F]")
+# ตัวอักษรไทย/อังกฤษ (ไม่นับตัวเลข)
+ALPHA_CHARS_RE = re.compile(r"[A-Za-z\u0E00-\u0E7F]")
+# page number แบบพวก "- 3 -" (\d / \s แบบ Unicode: รวมเลขไทย ๐-๙ และ space แบบ Unicode อยู่แล้ว)
+PAGE_NUMBER_RE = re.compile(r"-?\s*\d+\s*-?")
+
+
+def _collapse_newline_run(m: re.Match) -> str:
+    return "\n" if m.group(0).count("\n") == 1 else "\n\n"
 
 
 def _normalize_text(s: str) -> str:
@@ -41,24 +54,39 @@ def _normalize_text(s: str) -> str:
     if not s:
         return ""
 
-    # ลบ control char / zero-width / NBSP
-    s = CONTROL_CHAR_RE.sub("", s)
-    s = ZERO_WIDTH_RE.sub("", s)
-    s = NBSP_RE.sub(" ", s)
+    # ลบ control char / zero-width / NBSP (pass เดียว)
+    if NEEDS_TRANSLATE_RE.search(s):
+        s = s.translate(_CHAR_TRANSLATE)
 
     # แทน whitespace ภายในบรรทัดด้วย space เดียว
     # (ไม่ยุ่งกับ newline)
     s = INLINE_WS_RE.sub(" ", s)
 
-    # ลบ space รอบ newline
-    s = re.sub(r" *\n *", "\n", s)
-
-    # บีบ newline ซ้ำ ให้เหลือไม่เกิน 2 บรรทัดติดกัน
-    s = re.sub(r"\n{3,}", "\n\n", s)
+    # ลบ space รอบ newline + บีบ newline ซ้ำ ให้เหลือไม่เกิน 2 บรรทัดติดกัน
+    s = NEWLINE_RUN_RE.sub(_collapse_newline_run, s)
 
     return s.strip()
 
 
+# ใช้ process pool เมื่อมี block อย่างน้อยเท่านี้ (น้อยกว่านี้ overhead การส่งข้าม process ไม่คุ้ม)
+_PARALLEL_MIN_BLOCKS = 64
+
+
+def _normalize_many(contents: List[str]) -> List[str]:
+    """
+    _normalize_text หลายข้อความ
+    - ถ้าตั้ง CLEANER_WORKERS > 1 และข้อความเยอะพอ → กระจายไปหลาย process
+      (ใช้ process ไม่ใช่ thread เพราะ re ของ CPython ไม่ปล่อย GIL)
+    - ส่งไปแค่ string ไม่ส่ง TextBlock ทั้งก้อน เพื่อลดค่า pickle
+    """
+    if CLEANER_WORKERS <= 1 or len(contents) < _PARALLEL_MIN_BLOCKS:
+        return [_normalize_text(c) for c in contents]
+
+    chunksize = max(len(contents) // (CLEANER_WORKERS * 4), 1)
+    with ProcessPoolExecutor(max_workers=CLEANER_WORKERS) as pool:
+        return list(pool.map(_normalize_text, contents, chunksize=chunksize))
+
+
 def _is_noise_text(s: str) -> bool:
     """
     heuristic ง่าย ๆ ตรวจว่าข้อความน่าจะเป็น 'ขยะ' ไหม เช่น:
@@ -68,17 +96,17 @@ def _is_noise_text(s: str) -> bool:
     if not s:
         return True
 
-    # นับตัวอักษรสำคัญ
-    important = WORD_CHARS_RE.findall(s)
-    if len(important) <= 1:
+    # ต้องมีตัวอักษรสำคัญอย่างน้อย 2 ตัว (หยุดหาทันทีที่เจอตัวที่ 2 ไม่ต้องสร้าง list ทั้งก้อน)
+    important = WORD_CHARS_RE.finditer(s)
+    if next(important, None) is None or next(important, None) is None:
         return True
 
     # ถ้ายาวไม่เกิน 3 ตัว และไม่มีตัวอักษรไทย/อังกฤษ (เช่น "1", "-3-")
-    if len(s) <= 3 and not re.search(r"[A-Za-z\u0E00-\u0E7F]", s):
+    if len(s) <= 3 and not ALPHA_CHARS_RE.search(s):
         return True
 
     # ดัก pattern page number แบบพวก "- 3 -" หรือ "Page 3"
-    if re.fullmatch(r"-?\s*\d+\s*-?", s):
+    if PAGE_NUMBER_RE.fullmatch(s):
         return True
 
     return False
@@ -98,9 +126,10 @@ def clean_text_blocks(blocks: List[TextBlock]) -> List[TextBlock]:
     """
     cleaned: List[TextBlock] = []
 
-    for b in blocks:
-        original = b.content or ""
-        normalized = _normalize_text(original)
+    originals = [b.content or "" for b in blocks]
+    normalized_all = _normalize_many(originals)
+
+    for b, original, normalized in zip(blocks, originals, normalized_all):
 
         # เช็กว่ามีเนื้อหาจริงไหม
         if not normalized or _is_noise_text(normalized):
@@ -171,20 +200,22 @@ def clean_table_blocks(tables: List[TableBlock]) -> List[TableBlock]:
             ]
 
             # 3) ลบคอลัมน์ที่ว่างทุก cell
-            keep_col_idx = []
-            for idx in range(col_count):
-                col_vals = [header_padded[idx]] + [r[idx] for r in rows_padded]
-                if any(v.strip() for v in col_vals):
-                    keep_col_idx.append(idx)
-
-            header_final = [header_padded[i] for i in keep_col_idx]
-            rows_final = [[row[i] for i in keep_col_idx] for row in rows_padded]
+            # transpose เป็นรายคอลัมน์ครั้งเดียว แล้วเช็ก/กรองทีละคอลัมน์ (any หยุดที่ cell แรกที่มีค่า)
+            # cell ผ่าน _normalize_text (strip แล้ว) -> cell ว่าง = "" เช็กด้วย truthiness ได้เลย
+            cols = list(zip(header_padded, *rows_padded))
+            kept_cols = [col for col in cols if any(col)]
+
+            if kept_cols:
+                header_final, *rows_final = (list(r) for r in zip(*kept_cols))
+            else:
+                header_final = []
+                rows_final = [[] for _ in rows_padded]
         else:
             header_final = header_clean
             rows_final = rows_clean
 
         # 4) ลบแถวว่าง
-        rows_final = [r for r in rows_final if any(c.strip() for c in r)]
+        rows_final = [r for r in rows_final if any(r)]
 
         tb.header = header_final
         tb.rows = rows_final
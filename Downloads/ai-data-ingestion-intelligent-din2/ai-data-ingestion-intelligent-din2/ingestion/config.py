@@ -25,4 +25,12 @@ OCR_PASSWORD = os.getenv("OCR_PASSWORD", "aiuser@S0ftnix")
 # SSL Verification Logic
 # Default เป็น False ตามที่คุณต้องการ แต่ถ้าใน .env ส่งมาเป็น 'True' ก็จะเปิด verify ได้
 _verify_ssl_env = os.getenv("VERIFY_SSL", "False").lower()
-VERIFY_SSL = _verify_ssl_env in ("true", "1", "t")
\ No newline at end of file
+VERIFY_SSL = _verify_ssl_env in ("true", "1", "t")
+
+# เขียนภาพที่ส่ง OCR ลงไฟล์ debug_ocr_*.png/jpg (ปิดไว้ปกติ: ทำงานหลายหน้าพร้อมกันจะเขียนไฟล์ทับกันเอง)
+OCR_DEBUG = os.getenv("OCR_DEBUG", "False").lower() in ("true", "1", "t")
+
+# --- Cleaning ---
+# จำนวน process ที่ใช้ normalize text blocks พร้อมกัน (0/1 = ทำทีละ block ใน process เดียว)
+# คุ้มเฉพาะเอกสารใหญ่ ๆ เพราะต้องส่ง string ข้าม process
+CLEANER_WORKERS = int(os.getenv("CLEANER_WORKERS", "0"))
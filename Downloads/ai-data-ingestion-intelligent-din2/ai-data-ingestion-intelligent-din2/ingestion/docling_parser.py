@@ -1,7 +1,8 @@
 import time
 import logging
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # ต้องติดตั้ง docling ก่อน (pip install docling)
 from docling.document_converter import DocumentConverter, PdfFormatOption
@@ -11,23 +12,36 @@ from docling.datamodel.pipeline_options import PdfPipelineOptions
 # ตั้งค่า OCR (เปิด True ไว้จะช่วยให้ระบุตำแหน่งภาพในหน้าที่มีข้อความทับได้แม่นยำขึ้น)
 ENABLE_OCR = True  
 
+# DocumentConverter โหลดโมเดล layout/OCR ตอนสร้าง (ช้าหลายวินาที) -> สร้างครั้งเดียวแล้วใช้ร่วมกันทั้ง process
+_CONVERTER: Optional[DocumentConverter] = None
+_CONVERTER_LOCK = threading.Lock()
+
+
+def _get_converter() -> DocumentConverter:
+    global _CONVERTER
+    if _CONVERTER is None:
+        with _CONVERTER_LOCK:
+            if _CONVERTER is None:
+                # ตั้งค่า Pipeline ของ Docling ให้โฟกัสแค่ "รูปภาพ"
+                pipeline_options = PdfPipelineOptions()
+                pipeline_options.do_ocr = ENABLE_OCR
+                pipeline_options.do_table_structure = False # ปิด เพราะเรามี table_extractor แยกแล้ว (ประหยัดเวลา)
+                pipeline_options.generate_page_images = False # ปิด ไม่เอาภาพ Screenshot ทั้งหน้า
+                pipeline_options.generate_picture_images = True # ✅ เปิด เอาเฉพาะภาพประกอบ (Bitmap/Figure)
+                pipeline_options.images_scale = 2.0 # คุณภาพสูง (2x) เพื่อให้ AI อ่านชัด
+
+                _CONVERTER = DocumentConverter(
+                    format_options={
+                        InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+                    }
+                )
+    return _CONVERTER
+
+
 class DoclingImageParser:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        
-        # ตั้งค่า Pipeline ของ Docling ให้โฟกัสแค่ "รูปภาพ"
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.do_ocr = ENABLE_OCR
-        pipeline_options.do_table_structure = False # ปิด เพราะเรามี table_extractor แยกแล้ว (ประหยัดเวลา)
-        pipeline_options.generate_page_images = False # ปิด ไม่เอาภาพ Screenshot ทั้งหน้า
-        pipeline_options.generate_picture_images = True # ✅ เปิด เอาเฉพาะภาพประกอบ (Bitmap/Figure)
-        pipeline_options.images_scale = 2.0 # คุณภาพสูง (2x) เพื่อให้ AI อ่านชัด
-
-        self.converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-            }
-        )
+        self.converter = _get_converter()
 
     def extract_images(self, pdf_path: str, output_dir: str) -> List[Dict[str, Any]]:
         """
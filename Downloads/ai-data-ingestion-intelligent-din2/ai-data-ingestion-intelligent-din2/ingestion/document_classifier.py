@@ -16,9 +16,10 @@ document_classifier.py
 - ถ้า use_llm=True → ใช้ LLM ช่วย classify
 """
 
-from typing import List, Optional
+from typing import List, Optional, Set, Tuple
 from dotenv import load_dotenv
 import os
+import re
 
 load_dotenv()
 
@@ -50,16 +51,24 @@ PRIMARY_MODEL = os.getenv("CUSTOM_MODEL_NAME", "qwen/qwen-2.5-72b-instruct")
 
 
 def _collect_sample_text(texts: List[TextBlock], max_chars: int = 4000) -> str:
-    """รวม text block แรก ๆ เอามาเป็น sample text สำหรับ rule/LLM"""
-    chunks = []
-    total = 0
+    """
+    รวม text block แรก ๆ เอามาเป็น sample text สำหรับ rule/LLM
+    - ยาวไม่เกิน max_chars (นับ newline ที่ใช้คั่นด้วย) block สุดท้ายที่ล้นจะถูกตัดให้พอดี
+    """
+    chunks: List[str] = []
+    remaining = max_chars
     for t in texts:
-        if not t.content:
+        content = t.content
+        if not content:
             continue
-        if total + len(t.content) > max_chars:
+        n = len(content)
+        if n >= remaining:
+            chunks.append(content[:remaining])
+            break
+        chunks.append(content)
+        remaining -= n + 1  # +1 = "\n" ที่ใช้คั่น
+        if remaining <= 0:
             break
-        chunks.append(t.content)
-        total += len(t.content)
     return "\n".join(chunks)
 
 
@@ -83,48 +92,9 @@ def _get_custom_api_config() -> tuple[Optional[str], Optional[str]]:
 # 1) RULE-BASED CLASSIFIER (พื้นฐาน)
 # ============================================================
 
-
-def classify_document_rule_based(doc: IngestedDocument) -> str:
-    """จำแนกเอกสารแบบง่าย ๆ ไม่ใช้ AI"""
-    file_name = (doc.metadata.file_name or "").lower()
-    sample = _collect_sample_text(doc.texts).lower()
-
-    # ------------------------
-    # 1) Q&A / แบบฝึกหัด / ข้อสอบ
-    # ------------------------
-    # ใช้ทั้งจากชื่อไฟล์ + เนื้อหา
-    if any(k in file_name for k in ["qna", "q&a", "qa", "quiz", "exam", "ข้อสอบ", "แบบฝึกหัด"]):
-        return "qna"
-
-    if ("ถาม:" in sample and "ตอบ:" in sample) or ("คำถาม" in sample and "คำตอบ" in sample):
-        return "qna"
-
-    # ------------------------
-    # 2) rule จากชื่อไฟล์
-    # ------------------------
-    if "statement" in file_name and "bank" in file_name:
-        return "bank_statement"
-
-    if "statement" in file_name and any(k in file_name for k in ["acct", "account", "บัญชี"]):
-        return "bank_statement"
-
-    if "invoice" in file_name:
-        return "invoice"
-
-    if "receipt" in file_name:
-        return "receipt"
-
-    if "po_" in file_name or "purchase_order" in file_name:
-        return "purchase_order"
-
-    if "delivery" in file_name or "dnote" in file_name:
-        return "delivery_note"
-
-    # ------------------------
-    # 3) rule จากเนื้อหา (ภาษาอังกฤษ + ไทย)
-    # ------------------------
-    # bank statement
-    if any(k in sample for k in [
+# keyword ในเนื้อหา -> label (เรียงตามลำดับความสำคัญ: ตัวแรกที่เจอชนะ)
+_CONTENT_RULES: List[Tuple[str, Tuple[str, ...]]] = [
+    ("bank_statement", (
         "account statement",
         "statement period",
         "account number",
@@ -132,52 +102,112 @@ def classify_document_rule_based(doc: IngestedDocument) -> str:
         "ยอดคงเหลือ",
         "รายการเดินบัญชี",
         "รายการเคลื่อนไหวบัญชี",
-    ]):
-        return "bank_statement"
-
-    # invoice
-    if any(k in sample for k in [
+    )),
+    ("invoice", (
         "invoice no",
         "tax invoice",
         "เลขที่ใบกำกับภาษี",
         "เลขที่ใบแจ้งหนี้",
-    ]):
-        return "invoice"
-
-    # receipt
-    if any(k in sample for k in [
+    )),
+    ("receipt", (
         "receipt no",
         "official receipt",
         "thank you for your payment",
         "ใบเสร็จรับเงิน",
-    ]):
-        return "receipt"
-
-    # purchase order
-    if any(k in sample for k in [
+    )),
+    ("purchase_order", (
         "purchase order",
         "ใบสั่งซื้อ",
-    ]):
-        return "purchase_order"
-
-    # delivery note
-    if any(k in sample for k in [
+    )),
+    ("delivery_note", (
         "delivery note",
         "ใบส่งของ",
         "ใบส่งสินค้า",
-    ]):
-        return "delivery_note"
-
-    # tax form
-    if any(k in sample for k in [
+    )),
+    ("tax_form", (
         "tax form",
         "withholding tax",
         "หนังสือรับรองการหักภาษี ณ ที่จ่าย",
-    ]):
-        return "tax_form"
+    )),
+]
+
+# คำที่บ่งบอกเอกสารถาม-ตอบ (ต้องเจอเป็นคู่)
+_QNA_MARKERS = ("ถาม:", "ตอบ:", "คำถาม", "คำตอบ")
+
+# keyword ในชื่อไฟล์ -> label: ทุกกลุ่มใน rule ต้องเจออย่างน้อย 1 คำ (เรียงตามลำดับความสำคัญ)
+_QNA_FILENAME_KEYWORDS = ("qna", "q&a", "qa", "quiz", "exam", "ข้อสอบ", "แบบฝึกหัด")
+_FILENAME_RULES: List[Tuple[str, Tuple[Tuple[str, ...], ...]]] = [
+    ("bank_statement", (("statement",), ("bank",))),
+    ("bank_statement", (("statement",), ("acct", "account", "บัญชี"))),
+    ("invoice", (("invoice",),)),
+    ("receipt", (("receipt",),)),
+    ("purchase_order", (("po_", "purchase_order"),)),
+    ("delivery_note", (("delivery", "dnote"),)),
+]
+
+
+def _compile_keyword_finder(keywords) -> re.Pattern:
+    """
+    รวม keyword ทุกตัวเป็น regex เดียว สแกนข้อความรอบเดียวแทน `k in text` ทีละคำ
+    ใช้ lookahead เพื่อให้เจอ keyword ที่ซ้อนทับกันได้ด้วย (เช่น "withholding tax invoice")
+    """
+    alternation = "|".join(re.escape(k) for k in sorted(set(keywords), key=len, reverse=True))
+    return re.compile(f"(?=({alternation}))")
+
+
+_CONTENT_KEYWORDS_RE = _compile_keyword_finder(
+    [*_QNA_MARKERS, *(k for _, kws in _CONTENT_RULES for k in kws)]
+)
+_FILENAME_KEYWORDS_RE = _compile_keyword_finder(
+    [*_QNA_FILENAME_KEYWORDS, *(k for _, groups in _FILENAME_RULES for g in groups for k in g)]
+)
+
+
+def _find_keywords(pattern: re.Pattern, text: str) -> Set[str]:
+    """คืน keyword ทั้งหมดของ pattern ที่ปรากฏใน text"""
+    return {m.group(1) for m in pattern.finditer(text)}
+
+
+def classify_document_rule_based(doc: IngestedDocument, sample_text: Optional[str] = None) -> str:
+    """
+    จำแนกเอกสารแบบง่าย ๆ ไม่ใช้ AI
+    - sample_text: ถ้า caller รวม sample ไว้แล้ว (เช่น LLM path ที่ fallback มา) ส่งมาได้เลย ไม่ต้องรวมใหม่
+    """
+    file_name = (doc.metadata.file_name or "").lower()
+    if sample_text is None:
+        sample_text = _collect_sample_text(doc.texts)
+    sample = sample_text.lower()
+
+    # ------------------------
+    # 1) Q&A / แบบฝึกหัด / ข้อสอบ
+    # ------------------------
+    # ใช้ทั้งจากชื่อไฟล์ + เนื้อหา
+    # สแกนชื่อไฟล์ / sample อย่างละครั้งเดียวหา keyword ทุกตัว แล้วใช้ผลร่วมกันทุก rule ด้านล่าง
+    file_hits = _find_keywords(_FILENAME_KEYWORDS_RE, file_name)
+    if not file_hits.isdisjoint(_QNA_FILENAME_KEYWORDS):
+        return "qna"
+
+    hits = _find_keywords(_CONTENT_KEYWORDS_RE, sample)
+
+    if ("ถาม:" in hits and "ตอบ:" in hits) or ("คำถาม" in hits and "คำตอบ" in hits):
+        return "qna"
+
+    # ------------------------
+    # 2) rule จากชื่อไฟล์
+    # ------------------------
+    for label, groups in _FILENAME_RULES:
+        if all(not file_hits.isdisjoint(group) for group in groups):
+            return label
+
+    # ------------------------
+    # 3) rule จากเนื้อหา (ภาษาอังกฤษ + ไทย) เรียงตามลำดับความสำคัญใน _CONTENT_RULES
+    # ------------------------
+    for label, keywords in _CONTENT_RULES:
+        if not hits.isdisjoint(keywords):
+            return label
 
     # Q&A อีกที (สำรอง)
-    if "ถาม:" in sample and "ตอบ:" in sample:
+    if "ถาม:" in hits and "ตอบ:" in hits:
         return "qna"
 
     return "generic"
@@ -197,16 +227,19 @@ def classify_document_with_llm(
     - ใช้โมเดล fix (PRIMARY_MODEL) ถ้าไม่กำหนด
     - ถ้า error / ไม่มี KEY → fallback rule-based
     """
+    # เตรียมข้อความ (รวมครั้งเดียว ใช้ทั้งใน prompt และตอน fallback rule-based)
+    sample_text = _collect_sample_text(doc.texts, max_chars=4000)
+
     try:
         from openai import OpenAI
     except ImportError:
         print("[document_classifier] openai library not installed -> fallback rule-based")
-        return classify_document_rule_based(doc)
+        return classify_document_rule_based(doc, sample_text)
 
     api_key, api_base = _get_custom_api_config()
     if not api_key or not api_base:
         print("[document_classifier] No Custom API Config → fallback rule-based")
-        return classify_document_rule_based(doc)
+        return classify_document_rule_based(doc, sample_text)
 
     try:
         client = OpenAI(
@@ -215,15 +248,12 @@ def classify_document_with_llm(
         )
     except Exception as e:
         print(f"[document_classifier] OpenAI Client init failed: {e}")
-        return classify_document_rule_based(doc)
+        return classify_document_rule_based(doc, sample_text)
 
     # เลือก model
     if model_name is None:
         model_name = PRIMARY_MODEL
 
-    # เตรียมข้อความ
-    sample_text = _collect_sample_text(doc.texts, max_chars=4000)
-
     prompt = f"""
 คุณเป็นตัวช่วยจำแนกประเภทไฟล์เอกสาร (PDF) ภาษาไทยและอังกฤษ
 
@@ -302,7 +332,7 @@ generic
     except Exception as e:
         print(f"[document_classifier] LLM classify failed: {e}")
         # Fallback to rule-based
-        return classify_document_rule_based(doc)
+        return classify_document_rule_based(doc, sample_text)
 
 
 # ============================================================
@@ -330,9 +360,10 @@ def classify_document(doc: IngestedDocument, use_llm: bool = True) -> str:
 # ============================================================
 
 if __name__ == "__main__":
-    import json
     from pathlib import Path
 
+    from ingestion.schema import loads
+
     # ทดสอบโหลดจาก ingested/sample (ต้องมีไฟล์ก่อน)
     root = Path("ingested") / "sample"
     meta_path = root / "metadata.json"
@@ -341,8 +372,8 @@ if __name__ == "__main__":
     if not meta_path.exists() or not text_path.exists():
         print("Please run ingestion first: ingested/sample/metadata.json + text.json not found.")
     else:
-        meta = json.loads(meta_path.read_text(encoding="utf-8"))
-        texts = json.loads(text_path.read_text(encoding="utf-8"))
+        meta = loads(meta_path.read_bytes())
+        texts = loads(text_path.read_bytes())
 
         doc = IngestedDocument(
             metadata=DocumentMetadata.from_dict(meta),
@@ -11,14 +11,15 @@ image_extractor.py
 - แปลงผลลัพธ์เป็น list[ImageBlock] ตาม schema
 """
 
+import asyncio
 import time
-import base64
+import re
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Mapping, Optional, Tuple
 
 # [CHANGE] เลิกใช้ fitz ในการดึงรูป (แต่ใช้ Docling แทน)
 # import fitz  <-- ลบทิ้งได้เลย หรือ comment ไว้
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
 from PIL import Image
 
 from .schema import ImageBlock
@@ -28,17 +29,36 @@ from .docling_parser import DoclingImageParser
 from dotenv import load_dotenv
 import os
 
+# pybase64 (SIMD) เร็วกว่า base64 มาตรฐานหลายเท่ากับรูปใหญ่ ถ้าไม่ได้ติดตั้งก็ใช้ตัวมาตรฐาน
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 load_dotenv()
 
 # [CHANGE] เลือกโมเดลที่เหมาะสมที่สุดสำหรับงาน Vision จากลิสต์
 VISION_MODEL_NAME = "qwen/qwen2.5-vl-32b-instruct"
 
+# Rate limit: พักเฉพาะตอน quota ที่เหลือต่ำกว่านี้ หรือโดน 429 (แทนการพัก 15s ทุกรูป)
+RATE_LIMIT_MIN_REMAINING = 5
+# เวลาพักเมื่อโดน 429 แต่ API ไม่บอกเวลา reset มา (= ค่า cooldown เดิม)
+RATE_LIMIT_DEFAULT_WAIT_SEC = 15.0
+RATE_LIMIT_MAX_WAIT_SEC = 120.0
+
+# จำนวนรูปที่ส่งไปทำ caption พร้อมกัน
+CAPTION_CONCURRENCY = 4
+
+# duration แบบ OpenAI เช่น "1m30s", "20ms", "0.5s"
+_DURATION_PART_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNIT_SEC = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
 # -------------------------------------------------------------------
 # Helper: Vision API (คงเดิม ไม่แตะต้อง)
 # -------------------------------------------------------------------
 
-def _get_vision_client() -> tuple[Optional[OpenAI], Optional[str]]:
-    """เตรียม OpenAI Client สำหรับงาน Vision"""
+def _get_vision_client() -> tuple[Optional[AsyncOpenAI], Optional[str]]:
+    """เตรียม OpenAI Client (async) สำหรับงาน Vision"""
     api_key = os.getenv("CUSTOM_API_KEY")
     base_url = os.getenv("CUSTOM_API_BASE")
 
@@ -47,7 +67,7 @@ def _get_vision_client() -> tuple[Optional[OpenAI], Optional[str]]:
         return None, None
 
     try:
-        client = OpenAI(
+        client = AsyncOpenAI(
             api_key=api_key,
             base_url=base_url
         )
@@ -57,14 +77,70 @@ def _get_vision_client() -> tuple[Optional[OpenAI], Optional[str]]:
         return None, None
 
 def _encode_image(image_path: Path) -> str:
-    """แปลงไฟล์รูปเป็น Base64"""
+    """
+    แปลงไฟล์รูปเป็น Base64
+    - ปล่อย raw bytes ทันทีหลัง encode (รูป scale 2x ใหญ่หลาย MB ไม่ต้องถือทั้ง raw + base64 + str พร้อมกัน)
+    - base64 เป็น ASCII ล้วน decode แบบ ascii ได้เลย
+    """
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        data = image_file.read()
+    encoded = base64.b64encode(data)
+    del data
+    return encoded.decode("ascii")
+
+def _parse_reset_seconds(value: str) -> Optional[float]:
+    """
+    แปลงค่า reset/retry-after จาก header เป็นจำนวนวินาทีที่ต้องรอ
+    รองรับ: วินาทีตรง ๆ, duration แบบ "1m30s", epoch (วินาที/มิลลิวินาที)
+    """
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART_RE.findall(value)
+        if not parts:
+            return None
+        return sum(float(n) * _DURATION_UNIT_SEC[unit] for n, unit in parts)
+
+    if number > 1e12:  # epoch ms
+        return number / 1000 - time.time()
+    if number > 1e9:  # epoch seconds
+        return number - time.time()
+    return number
+
+
+def _rate_limit_wait(headers: Mapping[str, str], limited: bool = False) -> float:
+    """
+    คำนวณเวลาที่ควรพักก่อนยิงรูปถัดไปจาก rate-limit headers
+    - limited=False: พักเฉพาะตอน remaining ต่ำกว่า RATE_LIMIT_MIN_REMAINING
+    - limited=True (โดน 429): พักเสมอ ถ้าไม่รู้เวลา reset ใช้ RATE_LIMIT_DEFAULT_WAIT_SEC
+    """
+    if not limited:
+        remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("x-ratelimit-remaining")
+        try:
+            if remaining is None or int(float(remaining)) >= RATE_LIMIT_MIN_REMAINING:
+                return 0.0
+        except ValueError:
+            return 0.0
+
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset"):
+        value = headers.get(name)
+        if value:
+            wait = _parse_reset_seconds(value)
+            if wait is not None:
+                return min(max(wait, 0.0), RATE_LIMIT_MAX_WAIT_SEC)
+
+    return RATE_LIMIT_DEFAULT_WAIT_SEC
+
 
-def _generate_image_caption(client: OpenAI, model_name: str, image_path: Path) -> str:
-    """ส่งรูปไปให้ AI อธิบาย (Captioning) - ฟังก์ชันเดิมที่ทำงานดีอยู่แล้ว"""
+async def _generate_image_caption(client: AsyncOpenAI, model_name: str, image_path: Path) -> Tuple[str, float]:
+    """
+    ส่งรูปไปให้ AI อธิบาย (Captioning) - ฟังก์ชันเดิมที่ทำงานดีอยู่แล้ว
+    คืน (caption, วินาทีที่ควรพักก่อนเรียกรูปถัดไปตาม rate-limit headers)
+    - ถ้าโดน 429 จะพักตาม Retry-After แล้วลองใหม่ 1 ครั้ง
+    """
     if not client:
-        return ""
+        return "", 0.0
 
     try:
         # Encode รูปเป็น Base64
@@ -78,29 +154,74 @@ def _generate_image_caption(client: OpenAI, model_name: str, image_path: Path) -
             "ตอบเป็นภาษาไทย กระชับและได้ใจความ"
         )
 
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            },
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/png;base64,{base64_image}"
                         },
-                    ],
-                }
-            ],
-            max_tokens=300,
-        )
-        
-        return response.choices[0].message.content.strip()
+                    },
+                ],
+            }
+        ]
+
+        for attempt in range(2):
+            try:
+                # with_raw_response เพื่ออ่าน rate-limit headers ได้
+                raw = await client.chat.completions.with_raw_response.create(
+                    model=model_name,
+                    messages=messages,
+                    max_tokens=300,
+                )
+            except RateLimitError as e:
+                wait_sec = _rate_limit_wait(e.response.headers, limited=True)
+                if attempt > 0:
+                    print(f"[image_extractor] Caption generation failed for {image_path.name}: {e}")
+                    return "", wait_sec
+                print(f"   💤 Rate limited on {image_path.name}, retrying in {wait_sec:.1f}s...")
+                await asyncio.sleep(wait_sec)
+                continue
+
+            response = raw.parse()
+            return response.choices[0].message.content.strip(), _rate_limit_wait(raw.headers)
     except Exception as e:
         print(f"[image_extractor] Caption generation failed for {image_path.name}: {e}")
-        return ""
+    return "", 0.0
+
+
+async def _caption_images(client: AsyncOpenAI, model_name: str, image_paths: List[Path]) -> List[str]:
+    """
+    ทำ caption หลายรูปพร้อมกัน (ไม่เกิน CAPTION_CONCURRENCY) คืน caption เรียงตามลำดับ image_paths
+    - ถ้ารูปไหนได้ rate-limit wait กลับมา ทุก request ถัดไปจะรอจนถึงเวลานั้นก่อน
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(CAPTION_CONCURRENCY)
+    resume_at = 0.0
+
+    async def _caption_one(image_path: Path) -> str:
+        nonlocal resume_at
+        async with semaphore:
+            delay = resume_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            print(f"[image_extractor] Generating caption for {image_path.name} using {model_name}...")
+            caption, wait_sec = await _generate_image_caption(client, model_name, image_path)
+
+            # พักกัน Rate Limit เฉพาะตอน API บอกว่า quota ใกล้หมด
+            if wait_sec > 0:
+                print(f"   💤 Cooling down API for {wait_sec:.1f}s...")
+                resume_at = max(resume_at, loop.time() + wait_sec)
+            return caption
+
+    try:
+        return await asyncio.gather(*(_caption_one(p) for p in image_paths))
+    finally:
+        await client.close()
 
 # -------------------------------------------------------------------
 # Main Extraction (ส่วนที่แก้ไข Logic การดึงรูป)
@@ -137,8 +258,16 @@ def extract_images(
     # Docling จะจัดการเรื่องการวนลูปหน้าและเซฟไฟล์ให้เราเองในขั้นตอนนี้
     extracted_data = parser.extract_images(str(path), str(image_dir))
     
+    # [KEEP] AI Captioning Logic เดิม (สำคัญมาก) - ยิงพร้อมกันหลายรูปแทนทีละรูป
+    if client and extracted_data:
+        captions = asyncio.run(
+            _caption_images(client, model_name, [Path(item["file_path"]) for item in extracted_data])
+        )
+    else:
+        captions = [""] * len(extracted_data)
+
     # วนลูปข้อมูลรูปที่ได้จาก Docling
-    for i, item in enumerate(extracted_data):
+    for i, (item, caption_text) in enumerate(zip(extracted_data, captions)):
         file_path_on_disk = Path(item["file_path"])
         filename = item["filename"]
         page_number = item["page"]
@@ -147,16 +276,6 @@ def extract_images(
         # สร้าง ID
         img_id = f"img_{doc_id}_{i+1:04d}"
         
-        # [KEEP] AI Captioning Logic เดิม (สำคัญมาก)
-        caption_text = ""
-        if client:
-            print(f"[image_extractor] Generating caption for {filename} using {model_name}...")
-            caption_text = _generate_image_caption(client, model_name, file_path_on_disk)
-            
-            # [KEEP] ใส่ delay กัน Rate Limit ตามที่คุณต้องการ (15s)
-            print("   💤 Cooling down API for 15s...") 
-            time.sleep(15)
-
         # สร้าง Object ImageBlock ตาม Schema เดิม
         image_block = ImageBlock(
             id=img_id,
@@ -5,78 +5,206 @@ import re
 import time
 import json
 import os # [NEW]
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
 from typing import List, Dict, Any, Optional, Set
 
 import fitz  # PyMuPDF
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 import cv2
 import numpy as np
 
-from ingestion.config import OCR_API_URL, OCR_USERNAME, OCR_PASSWORD, VERIFY_SSL
+# orjson parse response ใหญ่ ๆ ได้เร็วกว่า json มาตรฐานหลายเท่า ถ้าไม่ได้ติดตั้งก็ใช้ตัวมาตรฐาน
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+from ingestion.config import OCR_API_URL, OCR_USERNAME, OCR_PASSWORD, VERIFY_SSL, OCR_DEBUG
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 _CACHED_TOKEN = None
 _TOKEN_EXPIRY = 0
+# กันหลาย thread login พร้อมกันตอน token หมดอายุ
+_TOKEN_LOCK = threading.Lock()
+# เก็บ token ลงไฟล์ให้ process ถัดไป (เช่นรันสคริปต์ ingest รอบใหม่) ใช้ต่อได้โดยไม่ต้อง login ใหม่
+_TOKEN_CACHE_PATH = Path(os.getenv("OCR_TOKEN_CACHE", str(Path.home() / ".cache" / "ocr_token.json")))
+# จำนวนหน้าที่ส่ง OCR พร้อมกันสูงสุด (ไม่เกิน pool_maxsize ของ _SESSION)
+OCR_MAX_WORKERS = 8
+# ความละเอียดภาพที่ส่ง OCR: ตั้ง DPI ให้ด้านยาวของหน้าได้ประมาณนี้ (A4 ≈ 190 DPI ซึ่งพอสำหรับ Tesseract)
+OCR_TARGET_LONG_EDGE_PX = 2200
+OCR_MIN_DPI = 150
+OCR_MAX_DPI = 300
+# สัดส่วน pixel ดำ (หลัง Otsu) ที่ถือว่าหน้าว่าง/ดำทั้งหน้า -> ข้าม OCR
+OCR_BLANK_MIN_FG_RATIO = 0.002
+OCR_BLANK_MAX_FG_RATIO = 0.998
+
+# ใช้ Session เดียวทั้ง process เพื่อ reuse keep-alive connection (ไม่ต้อง TLS handshake ใหม่ทุกหน้า)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 _WORD_CHARS_PATTERN = re.compile(r"[A-Za-z0-9\u0E00-\u0E7F]")
 
 def _get_api_token() -> str:
+    token = _CACHED_TOKEN  # อ่านครั้งเดียว: thread อื่นอาจล้าง token ระหว่างนี้ (_refresh_rejected_token)
+    if token and time.time() < _TOKEN_EXPIRY - 60:
+        return token
+    with _TOKEN_LOCK:
+        # เช็กซ้ำ เผื่อ thread อื่น login ให้แล้วระหว่างรอ lock
+        if _CACHED_TOKEN and time.time() < _TOKEN_EXPIRY - 60:
+            return _CACHED_TOKEN
+        if _load_token_from_disk():
+            return _CACHED_TOKEN
+        return _login()
+
+def _set_token(token: str, expiry: float) -> None:
+    global _CACHED_TOKEN, _TOKEN_EXPIRY
+    _CACHED_TOKEN = token
+    _TOKEN_EXPIRY = expiry
+
+def _load_token_from_disk() -> bool:
+    """โหลด token จากไฟล์ cache ถ้ายังไม่หมดอายุและเป็นของ API/user เดียวกัน"""
+    try:
+        data = json.loads(_TOKEN_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    if data.get("api_url") != OCR_API_URL or data.get("username") != OCR_USERNAME:
+        return False
+    token, expiry = data.get("access_token"), data.get("expiry", 0)
+    if not token or time.time() >= expiry - 60:
+        return False
+    _set_token(token, expiry)
+    return True
+
+def _save_token_to_disk() -> None:
+    """เขียนไฟล์ cache แบบ atomic (เขียนไฟล์ชั่วคราวแล้ว os.replace) และให้อ่านได้เฉพาะเจ้าของไฟล์"""
+    payload = {
+        "api_url": OCR_API_URL,
+        "username": OCR_USERNAME,
+        "access_token": _CACHED_TOKEN,
+        "expiry": _TOKEN_EXPIRY,
+    }
+    tmp_path = _TOKEN_CACHE_PATH.with_name(f"{_TOKEN_CACHE_PATH.name}.{os.getpid()}.tmp")
+    try:
+        _TOKEN_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, _TOKEN_CACHE_PATH)
+    except OSError as e:
+        print(f"[OCR-API] Could not cache token on disk: {e}")
+
+def _refresh_rejected_token(rejected_token: str) -> str:
+    """
+    server ปฏิเสธ token (401/403 เช่น server restart / เปลี่ยนรหัส) -> ทิ้ง token ทั้งในหน่วยความจำ
+    และไฟล์ cache แล้ว login ใหม่ (ถ้า thread อื่น login ใหม่ให้แล้วก็ใช้ token นั้นเลย)
+    """
     global _CACHED_TOKEN, _TOKEN_EXPIRY
-    if _CACHED_TOKEN and time.time() < _TOKEN_EXPIRY - 60:
-        return _CACHED_TOKEN
+    with _TOKEN_LOCK:
+        if _CACHED_TOKEN and _CACHED_TOKEN != rejected_token:
+            return _CACHED_TOKEN
+        _CACHED_TOKEN = None
+        _TOKEN_EXPIRY = 0
+        try:
+            _TOKEN_CACHE_PATH.unlink()
+        except OSError:
+            pass
+        return _login()
 
+def _login() -> str:
     login_url = f"{OCR_API_URL}/login"
     payload = {"username": OCR_USERNAME, "password": OCR_PASSWORD}
     
     try:
-        response = requests.post(login_url, data=payload, verify=VERIFY_SSL, timeout=10)
+        response = _SESSION.post(login_url, data=payload, verify=VERIFY_SSL, timeout=10)
         response.raise_for_status()
         data = response.json()
         token = data.get("access_token")
         if not token:
             raise ValueError("No access_token in login response")
-        _CACHED_TOKEN = token
-        _TOKEN_EXPIRY = time.time() + (30 * 60) 
+        _set_token(token, time.time() + (30 * 60))
+        _save_token_to_disk()
         return token
     except Exception as e:
         print(f"[OCR-API] Login Failed: {e}")
         raise
 
-def pdf_page_to_image_bytes(page: fitz.Page, dpi: int = 300) -> bytes:
-    pix = page.get_pixmap(dpi=dpi)
-    return pix.tobytes("png")
+def _adaptive_dpi(page: fitz.Page) -> int:
+    """เลือก DPI ตามขนาดหน้า (rect เป็นหน่วย point = 1/72 นิ้ว) ให้ด้านยาวได้ OCR_TARGET_LONG_EDGE_PX"""
+    long_edge_pt = max(page.rect.width, page.rect.height) or 1
+    dpi = int(OCR_TARGET_LONG_EDGE_PX / long_edge_pt * 72)
+    return max(OCR_MIN_DPI, min(OCR_MAX_DPI, dpi))
+
+def pdf_page_to_gray_array(page: fitz.Page, dpi: int = 300) -> np.ndarray:
+    """render หน้าเป็นภาพ grayscale ตรงเข้า numpy (ไม่ต้อง encode/decode PNG ระหว่างทาง)"""
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    # stride อาจมี padding ต่อแถว จึง reshape ตาม pix.stride แล้วตัดเหลือ pix.width
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def _encode_jpeg(img: np.ndarray, quality: int = 85) -> bytes:
+    # ภาพสีเทาต่อเนื่อง (ไม่ใช่ขาวดำ) JPEG เล็กกว่าและ encode เร็วกว่า PNG หลายเท่า
+    _, encoded_img = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded_img.tobytes()
+
+def _encode_png(img: np.ndarray) -> bytes:
+    # compression 1: zlib ระดับต่ำ encode เร็วกว่าค่า default (3) มาก ขนาดใหญ่ขึ้นเล็กน้อย
+    _, encoded_img = cv2.imencode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    return encoded_img.tobytes()
+
+# ตัวที่ไม่ printable ที่เจอบ่อยใน text จาก PDF/OCR (tab, CR, form feed, NBSP, soft hyphen, zero-width, line/para separator)
+_COMMON_UNPRINTABLE_RE = re.compile("[\t\r\x0b\x0c\xa0\xad\u200b-\u200f\u2028\u2029\ufeff]+")
+
+def _strip_unprintable(text: str) -> str:
+    """
+    ลบตัวอักษรที่ไม่ printable (เก็บ newline ไว้) ผลเหมือน loop isprintable ทีละตัว
+    แต่ข้อความส่วนใหญ่สะอาดอยู่แล้ว -> เช็กทั้งก้อนด้วย isprintable (C-level) ก่อน
+    """
+    if text.replace("\n", " ").isprintable():
+        return text
+    text = _COMMON_UNPRINTABLE_RE.sub("", text)
+    if text.replace("\n", " ").isprintable():
+        return text
+    return "".join(ch for ch in text if ch == "\n" or ch.isprintable())
+
+# หลัง _strip_unprintable จะไม่มี tab เหลือแล้ว: บีบเฉพาะ space ที่ซ้ำ (space เดี่ยวไม่ต้องแทนที่)
+_MULTI_SPACE_RE = re.compile(r" {2,}")
+# ช่วง space/newline ที่มี newline อย่างน้อย 1 ตัว (ลบ space รอบ newline + บีบบรรทัดว่างในรอบเดียว)
+_NEWLINE_RUN_RE = re.compile(r" *\n[ \n]*")
+
+def _collapse_newline_run(m: re.Match) -> str:
+    return "\n" if m.group(0).count("\n") == 1 else "\n\n"
 
 def _clean_text(text: str) -> str:
     if not text: return ""
-    text = "".join(ch for ch in text if ch == "\n" or ch.isprintable())
-    text = re.sub(r"[ \t]+", " ", text)
-    text = re.sub(r" *\n *", "\n", text)
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _strip_unprintable(text)
+    text = _MULTI_SPACE_RE.sub(" ", text)
+    if "\n" in text:
+        text = _NEWLINE_RUN_RE.sub(_collapse_newline_run, text)
     return text.strip()
 
 def _has_meaningful_text(text: str) -> bool:
     if not text: return False
-    matches = _WORD_CHARS_PATTERN.findall(text)
-    return len(matches) > 5
+    # ต้องมีตัวอักษรสำคัญมากกว่า 5 ตัว: หยุดหาทันทีที่เจอตัวที่ 6 ไม่ต้องสร้าง list ทั้งหน้า
+    matches = _WORD_CHARS_PATTERN.finditer(text)
+    return next(islice(matches, 5, None), None) is not None
 
-def _preprocess_image_cv2(image_bytes: bytes, debug_name: str = None) -> bytes:
+def _preprocess_image_cv2(gray: np.ndarray, debug_name: str = None) -> np.ndarray:
     """
-    เตรียมภาพสำหรับ Tesseract: Grayscale -> Denoise -> Thresholding (Otsu's)
+    เตรียมภาพสำหรับ Tesseract: (Grayscale จากตอน render แล้ว) -> Denoise -> Thresholding (Otsu's)
+    คืนภาพขาวดำ (binary) ให้ caller encode เอง
     """
-    if not image_bytes: return b""
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if img is None: return image_bytes
-
-    # 1. Grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # 2. Denoise
+    # 1. Denoise
     gray = cv2.medianBlur(gray, 3)
 
-    # 3. Thresholding (Otsu)
+    # 2. Thresholding (Otsu)
     _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     
     # [NEW] Save Debug Image ถ้าต้องการ
@@ -84,28 +212,43 @@ def _preprocess_image_cv2(image_bytes: bytes, debug_name: str = None) -> bytes:
         cv2.imwrite(debug_name, binary)
         print(f"   [DEBUG] Saved processed image to: {debug_name}")
 
-    _, encoded_img = cv2.imencode('.png', binary)
-    return encoded_img.tobytes()
+    return binary
+
+def _is_blank_page(binary: np.ndarray) -> bool:
+    """หน้าที่แทบไม่มี pixel ดำ (หน้าว่าง) หรือดำเกือบทั้งหน้า -> ไม่มีอะไรให้ OCR"""
+    fg_ratio = float(np.count_nonzero(binary == 0)) / binary.size
+    return fg_ratio < OCR_BLANK_MIN_FG_RATIO or fg_ratio > OCR_BLANK_MAX_FG_RATIO
 
-def _send_to_ocr_api(image_bytes: bytes) -> str:
+def _send_to_ocr_api(image_bytes: bytes, filename: str = "page.png", mime_type: str = "image/png") -> str:
     """ฟังก์ชันย่อยสำหรับส่ง Request จริงๆ"""
     try:
-        token = _get_api_token()
+        # ส่ง token แยกต่อ request (ไม่เก็บใน _SESSION.headers ที่หลาย thread ใช้ร่วมกัน)
+        token = _get_api_token()  # login/refresh ถ้าจำเป็น
         url = f"{OCR_API_URL}/process-file"
-        headers = {"Authorization": f"Bearer {token}"}
         
-        files = {'file': ('page.png', image_bytes, 'image/png')}
+        files = {'file': (filename, image_bytes, mime_type)}
         data = {
             "ocr_engine": "tesseract", 
             "lang": "tha+eng", # ลองใช้ tha (3-letter code) เผื่อ API รองรับ
             "options": "--psm 6" # ลองเพิ่ม PSM 6 (Assume single block) ถ้า API รองรับ
         }
 
-        response = requests.post(url, headers=headers, files=files, data=data, verify=VERIFY_SSL, timeout=45)
+        response = _SESSION.post(
+            url, headers={"Authorization": f"Bearer {token}"},
+            files=files, data=data, verify=VERIFY_SSL, timeout=45,
+        )
+        if response.status_code in (401, 403):
+            # token ที่ cache ไว้ (อาจมาจากไฟล์) ใช้ไม่ได้แล้ว -> login ใหม่แล้วลองอีกครั้งเดียว
+            print(f"[OCR-API] Token rejected ({response.status_code}), logging in again")
+            token = _refresh_rejected_token(token)
+            response = _SESSION.post(
+                url, headers={"Authorization": f"Bearer {token}"},
+                files=files, data=data, verify=VERIFY_SSL, timeout=45,
+            )
         if response.status_code != 200:
             return ""
             
-        result_json = response.json()
+        result_json = _json_loads(response.content)
         text = ""
         if "extracted_text" in result_json:
             pages = result_json["extracted_text"].get("pages", [])
@@ -122,21 +265,33 @@ def _send_to_ocr_api(image_bytes: bytes) -> str:
         print(f"❌ [OCR-API] Exception: {e!r}")
         return ""
 
-def ocr_page_via_api(image_bytes: bytes) -> str:
+def ocr_page_via_api(gray: np.ndarray) -> str:
+    if gray is None or gray.size == 0: return ""
+
+    binary = _preprocess_image_cv2(gray, debug_name="debug_ocr_processed.png" if OCR_DEBUG else None)
+
+    # 0. หน้าว่าง: ไม่ต้องยิง API (ไม่งั้นจะโดนทั้ง 2 รอบเพราะได้ข้อความ < 100 ตัว)
+    if _is_blank_page(binary):
+        print("      > Page looks blank. Skipping OCR.")
+        return ""
+
     # 1. ลองแบบ Preprocess (High Contrast) ก่อน
     print("      > Trying Method 1: Preprocessed (B&W)...")
-    processed_bytes = _preprocess_image_cv2(image_bytes, debug_name="debug_ocr_processed.png")
-    text_v1 = _send_to_ocr_api(processed_bytes)
+    text_v1 = _send_to_ocr_api(_encode_png(binary))
     
     # 2. Smart Retry: ถ้าได้ข้อความน้อยเกินไป (< 100 ตัว) ให้ลองส่งภาพ Original (Grayscale)
     if len(text_v1) < 100:
         print(f"      > Result too short ({len(text_v1)} chars). Retrying with Original Image...")
         
+        # encode ภาพ original เฉพาะตอนต้อง retry จริง (JPEG: ภาพขาวดำแบบ binary เท่านั้นที่ต้องเป็น PNG)
+        image_bytes = _encode_jpeg(gray)
+
         # Save Debug Original
-        with open("debug_ocr_original.png", "wb") as f:
-            f.write(image_bytes)
+        if OCR_DEBUG:
+            with open("debug_ocr_original.jpg", "wb") as f:
+                f.write(image_bytes)
 
-        text_v2 = _send_to_ocr_api(image_bytes)
+        text_v2 = _send_to_ocr_api(image_bytes, filename="page.jpg", mime_type="image/jpeg")
         
         print(f"      > Method 2 Result: {len(text_v2)} chars.")
         
@@ -150,7 +305,15 @@ def ocr_page_via_api(image_bytes: bytes) -> str:
 class OCRDocument:
     texts: List[Dict[str, Any]] = field(default_factory=list)
 
-def ocr_extract_document(pdf_path: str, target_pages: Optional[Set[int]] = None) -> OCRDocument:
+def ocr_extract_document(
+    pdf_path: str,
+    target_pages: Optional[Set[int]] = None,
+    dpi: Optional[int] = None,
+) -> OCRDocument:
+    """
+    ดึงข้อความจาก PDF: ใช้ text layer ถ้ามี ไม่งั้นส่งภาพหน้าไป OCR API
+    - dpi: ความละเอียดตอน render หน้าเพื่อ OCR (None = เลือกตามขนาดหน้าอัตโนมัติ)
+    """
     doc = fitz.open(pdf_path)
     result = OCRDocument()
     
@@ -177,22 +340,38 @@ def ocr_extract_document(pdf_path: str, target_pages: Optional[Set[int]] = None)
 
     if target_pages:
         print(f"[OCR] Sending {len(target_pages)} image-based pages to API...")
-        for idx, page in enumerate(doc):
-            page_no = idx + 1
-            if page_no in target_pages:
-                print(f"   - OCR Scanning Page {page_no}...", end=" ", flush=True)
-                image_bytes = pdf_page_to_image_bytes(page)
-                ocr_text = ocr_page_via_api(image_bytes)
-                
-                if ocr_text:
-                    print(f"✅ Final Result: {len(ocr_text)} chars.")
-                    result.texts.append({
-                        "page": page_no,
-                        "content": ocr_text,
-                        "source": "ocr_api_tesseract"
-                    })
-                else:
-                    print("❌ Failed.")
+        # render ทีละหน้าใน thread หลัก (PyMuPDF ไม่ thread-safe) แล้วส่งเข้า pool ทันทีที่ render เสร็จ
+        # จำกัดจำนวนหน้าที่ค้างอยู่ (render แล้วแต่ OCR ยังไม่เสร็จ) ไม่ให้ภาพทั้งเอกสารค้างใน memory พร้อมกัน
+        page_nos = sorted(p for p in target_pages if 1 <= p <= doc.page_count)
+        max_workers = max(1, min(OCR_MAX_WORKERS, len(page_nos)))
+        max_in_flight = 2 * max_workers
+        ocr_texts: Dict[int, str] = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending: Dict[Future, int] = {}
+            for page_no in page_nos:
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        ocr_texts[pending.pop(fut)] = fut.result()
+                page = doc[page_no - 1]
+                gray = pdf_page_to_gray_array(page, dpi=dpi or _adaptive_dpi(page))
+                pending[executor.submit(ocr_page_via_api, gray)] = page_no
+                del gray
+            for fut in as_completed(pending):
+                ocr_texts[pending[fut]] = fut.result()
+
+        for page_no in page_nos:
+            ocr_text = ocr_texts[page_no]
+            if ocr_text:
+                print(f"   - OCR Page {page_no}: ✅ Final Result: {len(ocr_text)} chars.")
+                result.texts.append({
+                    "page": page_no,
+                    "content": ocr_text,
+                    "source": "ocr_api_tesseract"
+                })
+            else:
+                print(f"   - OCR Page {page_no}: ❌ Failed.")
 
     result.texts.sort(key=lambda x: x["page"])
     doc.close()
@@ -13,15 +13,17 @@ pdf_parser.py (Enterprise Manual RAG Edition)
 - [NEW] Table Extraction & Embedding: ดึงตารางและฝังลง Vector DB ทันที
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple, Set
+from typing import Dict, List, Optional, Tuple, Set
+import os
 import sys
 import logging
 import re
-import statistics
 
 import fitz  # PyMuPDF
+import numpy as np
 
 from .schema import (
     DocumentMetadata,
@@ -33,33 +35,13 @@ from .schema import (
 # [NEW] Imports for Table Handling
 from .table_extractor import extract_tables, table_to_text
 
-# ==============================================================================
-# [CRITICAL FIX] Correct Import for backend/services/vector_store.py
-# ==============================================================================
-try:
-    # 1. ลอง Import ตาม Path ที่ถูกต้อง: backend.services.vector_store
-    from backend.services.vector_store import get_vector_store
-except ImportError:
-    # 2. ถ้าไม่เจอ (อาจเพราะรัน script แล้ว python path ไม่ถึง root)
-    # ให้ถอยกลับไปหา Root Folder (AI_Data_Ingestion) แล้ว Add เข้า sys.path
-    try:
-        current_file = Path(__file__).resolve()
-        # ingestion/pdf_parser.py -> parent=ingestion -> parent=AI_Data_Ingestion (Root)
-        project_root = current_file.parents[1]
-        
-        if str(project_root) not in sys.path:
-            sys.path.append(str(project_root))
-            
-        from backend.services.vector_store import get_vector_store
-    except ImportError as e:
-        raise ImportError(
-            f"CRITICAL ERROR: ไม่สามารถ Import 'backend.services.vector_store' ได้\n"
-            f"ตำแหน่งไฟล์ที่คาดหวัง: {project_root / 'backend/services/vector_store.py'}\n"
-            f"Error details: {e}"
-        )
-
 logger = logging.getLogger(__name__)
 
+# ใช้หลาย process ดึงข้อความเฉพาะเอกสารที่มีหน้าอย่างน้อยเท่านี้ (น้อยกว่านี้ค่า start process ไม่คุ้ม)
+_PARALLEL_MIN_PAGES = 16
+# จำนวน block ต่อหน้าขั้นต่ำที่คุ้มจะใช้ numpy หา header/footer และเรียงลำดับ (หน้าเล็ก ๆ ค่าสร้าง array แพงกว่า loop ปกติ)
+_NUMPY_MIN_BLOCKS = 64
+
 
 # -------------------------------------------------------------------
 # 1. Config & Text Normalization
@@ -70,19 +52,40 @@ def _generate_doc_id(file_path: Path) -> str:
 
 _WORD_CHARS_PATTERN = re.compile(r"[A-Za-z0-9\u0E00-\u0E7F]")
 
+# ตัวที่ไม่ printable ที่เจอบ่อยใน text จาก PDF/OCR (tab, CR, form feed, NBSP, soft hyphen, zero-width, line/para separator)
+_COMMON_UNPRINTABLE_RE = re.compile("[\t\r\x0b\x0c\xa0\xad\u200b-\u200f\u2028\u2029\ufeff]+")
+
+def _strip_unprintable(text: str) -> str:
+    """
+    ลบตัวอักษรที่ไม่ printable (เก็บ newline ไว้) ผลเหมือน loop isprintable ทีละตัว
+    แต่ข้อความส่วนใหญ่สะอาดอยู่แล้ว -> เช็กทั้งก้อนด้วย isprintable (C-level) ก่อน
+    """
+    if text.replace("\n", " ").isprintable():
+        return text
+    text = _COMMON_UNPRINTABLE_RE.sub("", text)
+    if text.replace("\n", " ").isprintable():
+        return text
+    return "".join(ch for ch in text if ch == "\n" or ch.isprintable())
+
+# หลัง _strip_unprintable จะไม่มี tab เหลือแล้ว: บีบเฉพาะ space ที่ซ้ำ (space เดี่ยวไม่ต้องแทนที่)
+_MULTI_SPACE_RE = re.compile(r" {2,}")
+_SPACED_NEWLINE_RE = re.compile(r" *\n *")
+
 def _clean_text(text: str) -> str:
     if not text: return ""
     # ลบ control chars แต่เก็บ newline ไว้บางส่วนถ้าจำเป็น (ในที่นี้เรา merge แล้วจัดการทีหลัง)
-    text = "".join(ch for ch in text if ch == "\n" or ch.isprintable())
-    text = re.sub(r"[ \t]+", " ", text)
-    text = re.sub(r" *\n *", "\n", text)
+    text = _strip_unprintable(text)
+    text = _MULTI_SPACE_RE.sub(" ", text)
+    # ข้อความที่ต่อจาก spans ไม่มี newline อยู่แล้วเกือบทั้งหมด -> ข้าม pass นี้ได้
+    if "\n" in text:
+        text = _SPACED_NEWLINE_RE.sub("\n", text)
     return text.strip()
 
 def _is_meaningful_text(text: str) -> bool:
     if not text: return False
-    matches = _WORD_CHARS_PATTERN.findall(text)
-    if len(matches) < 2: return False
-    return True
+    # ต้องมีตัวอักษรสำคัญอย่างน้อย 2 ตัว (หยุดหาทันทีที่เจอตัวที่ 2 ไม่ต้องสร้าง list ทั้งก้อน)
+    matches = _WORD_CHARS_PATTERN.finditer(text)
+    return next(matches, None) is not None and next(matches, None) is not None
 
 def _normalize_section_title(text: str) -> str:
     text = text.strip()
@@ -110,34 +113,57 @@ _ENTITY_KEYWORDS = [
     "terminal", "cable", "motor", "pump", "valve", "controller"
 ] # ตัวอย่าง entity
 
+# ดูแค่ต้นข้อความ (prefix ยาวพอสำหรับ keyword ที่ยาวที่สุด) ไม่ต้อง upper() ทั้ง block
+_BLOCK_TYPE_PREFIX_LEN = 40
+_BT_WARNING_RE = re.compile(r"^(WARNING|CAUTION|DANGER|คำเตือน|ข้อควรระวัง)[:\s]", re.IGNORECASE)
+_BT_NOTE_RE = re.compile(r"^(NOTE|NOTICE|IMPORTANT|หมายเหตุ|สำคัญ|ข้อสังเกต)[:\s]", re.IGNORECASE)
+# Step detection: Numbered list or "Step X"
+_BT_STEP_RE = re.compile(r"^(\d+\.|Step\s+\d+|ขั้นตอนที่\s+\d+|[A-Z]\.)\s", re.IGNORECASE)
+
 def _detect_block_type(text: str) -> str:
-    text_upper = text.upper()
-    if re.match(r"^(WARNING|CAUTION|DANGER|คำเตือน|ข้อควรระวัง)[:\s]", text_upper):
+    prefix = text[:_BLOCK_TYPE_PREFIX_LEN]
+    if _BT_WARNING_RE.match(prefix):
         return "warning"
-    if re.match(r"^(NOTE|NOTICE|IMPORTANT|หมายเหตุ|สำคัญ|ข้อสังเกต)[:\s]", text_upper):
+    if _BT_NOTE_RE.match(prefix):
         return "note"
-    # Step detection: Numbered list or "Step X"
-    if re.match(r"^(\d+\.|Step\s+\d+|ขั้นตอนที่\s+\d+|[A-Z]\.)\s", text, re.IGNORECASE):
+    if _BT_STEP_RE.match(prefix):
         return "step"
     return "normal"
 
-def _analyze_intent(text: str, section: str) -> List[str]:
-    """เดา Intent จากเนื้อหาและชื่อ Section"""
-    combined = (text + " " + (section or "")).lower()
-    intents = []
+def _build_intent_index() -> Dict[str, List[str]]:
+    """keyword (lowercase) -> intent ที่เกี่ยวข้อง"""
+    index: Dict[str, List[str]] = {}
     for intent, keywords in _INTENT_KEYWORDS.items():
-        if any(k in combined for k in keywords):
-            intents.append(intent)
-    return list(set(intents))
-
-def _extract_entities(text: str) -> List[str]:
-    """ดึง Entity สำคัญ (Simple matching)"""
-    text_lower = text.lower()
-    found = []
-    for entity in _ENTITY_KEYWORDS:
-        if entity in text_lower:
-            found.append(entity)
-    return found
+        for kw in keywords:
+            index.setdefault(kw.lower(), []).append(intent)
+    return index
+
+_INTENT_BY_KEYWORD = _build_intent_index()
+_ENTITY_ORDER = {e: i for i, e in enumerate(_ENTITY_KEYWORDS)}
+
+# รวม keyword ของ intent + entity เป็น regex เดียว สแกนข้อความรอบเดียวแทน `k in text` ทีละคำ
+# ใช้ lookahead เพื่อให้เจอ keyword ที่ซ้อนทับกันได้ด้วย
+_KEYWORDS_RE = re.compile(
+    "(?=("
+    + "|".join(re.escape(k) for k in sorted({*_INTENT_BY_KEYWORD, *_ENTITY_ORDER}, key=len, reverse=True))
+    + "))"
+)
+
+def _analyze_keywords(text: str, section: Optional[str]) -> Tuple[List[str], List[str]]:
+    """
+    เดา Intent (จากเนื้อหา + ชื่อ Section) และดึง Entity สำคัญ (จากเนื้อหาอย่างเดียว) ในการสแกนรอบเดียว
+    คืน (intents, entities) โดย entities เรียงตามลำดับใน _ENTITY_KEYWORDS
+    """
+    text_len = len(text)
+    combined = (text + " " + (section or "")).lower()
+    intents: Set[str] = set()
+    entities: Set[str] = set()
+    for m in _KEYWORDS_RE.finditer(combined):
+        kw = m.group(1)
+        intents.update(_INTENT_BY_KEYWORD.get(kw, ()))
+        if kw in _ENTITY_ORDER and m.start() + len(kw) <= text_len:
+            entities.add(kw)
+    return list(intents), sorted(entities, key=_ENTITY_ORDER.__getitem__)
 
 def _determine_answer_scope(block_type: str) -> str:
     """กำหนดรูปแบบคำตอบที่เหมาะสม"""
@@ -154,13 +180,18 @@ def _detect_header_footer(blocks: List[dict], page_height: float) -> List[dict]:
     HEADER_THRESH = page_height * 0.07
     FOOTER_THRESH = page_height * 0.93
     
-    for b in blocks:
-        x0, y0, x1, y1 = b.get("bbox", (0,0,0,0))
+    if len(blocks) < _NUMPY_MIN_BLOCKS:
+        headers = [b.get("bbox", (0,0,0,0))[3] < HEADER_THRESH for b in blocks]
+        footers = [b.get("bbox", (0,0,0,0))[1] > FOOTER_THRESH for b in blocks]
+    else:
+        # หน้าที่มี block เยอะ: เทียบ threshold ทั้งหน้าทีเดียว (tolist() ให้ได้ bool ของ Python กลับมา)
+        bbs = np.array([b.get("bbox", (0,0,0,0)) for b in blocks], dtype=np.float64)
+        headers = (bbs[:, 3] < HEADER_THRESH).tolist()
+        footers = (bbs[:, 1] > FOOTER_THRESH).tolist()
+    
+    for b, is_header, is_footer in zip(blocks, headers, footers):
         if "extra" not in b: b["extra"] = {}
         
-        is_header = y1 < HEADER_THRESH
-        is_footer = y0 > FOOTER_THRESH
-        
         b["extra"]["is_header"] = is_header
         b["extra"]["is_footer"] = is_footer
         
@@ -176,7 +207,14 @@ def _sort_blocks_reading_order(blocks: List[dict]) -> List[dict]:
     (ช่วยให้อ่าน 2 Column ได้ถูกต้อง โดยการ group Y ที่ใกล้เคียงกัน)
     """
     # Round Y0 to nearest 12px to treat them as same 'line'
-    return sorted(blocks, key=lambda b: (int(b["bbox"][1] / 12), b["bbox"][0]))
+    if len(blocks) < _NUMPY_MIN_BLOCKS:
+        return sorted(blocks, key=lambda b: (int(b["bbox"][1] / 12), b["bbox"][0]))
+
+    # หน้าที่มี block เยอะ: lexsort ทั้งหน้าทีเดียวแทนการเรียก lambda ทีละ block
+    # (float64 + ตัดทศนิยมแบบ int() ให้ได้ลำดับเดียวกับ sorted ข้างบน, lexsort เป็น stable sort เหมือนกัน)
+    bb = np.array([b["bbox"][:2] for b in blocks], dtype=np.float64)
+    order = np.lexsort((bb[:, 0], (bb[:, 1] / 12).astype(np.int64)))
+    return [blocks[i] for i in order]
 
 # -------------------------------------------------------------------
 # 4. Smart Merge Logic (The "Senior" Part)
@@ -256,35 +294,21 @@ def _merge_text_blocks(blocks: List[TextBlock]) -> List[TextBlock]:
 # -------------------------------------------------------------------
 # 5. Page Extraction Logic
 # -------------------------------------------------------------------
-def _extract_text_blocks_from_page(
-    pdf_page: fitz.Page,
-    doc_id: str,
-    page_number: int,
-    start_index: int = 0,
-    current_section: Optional[str] = None
-) -> Tuple[List[TextBlock], Optional[str]]:
-    
+# ข้อมูลของ block ที่ได้จากหน้า PDF ก่อนผูก section/intent (ไม่ขึ้นกับหน้าก่อนหน้า -> แยก process ได้)
+RawPage = Tuple[Optional[List[dict]], Optional[str]]
+
+def _extract_raw_page_blocks(pdf_page: fitz.Page, page_number: int) -> RawPage:
+    """
+    ส่วนที่หนักที่สุดของการ parse ต่อหน้า (get_text dict, layout, ทำความสะอาด, heading, block type)
+    คืน (raw_blocks, None) หรือ (None, fallback_text) ถ้าดึงแบบ dict ไม่ได้
+    """
     try:
         # ใช้ raw dict เพื่อ control เองทั้งหมด
         page_dict = pdf_page.get_text("dict", flags=fitz.TEXT_PRESERVE_IMAGES)
     except Exception as e:
         logger.warning(f"Page {page_number} dict extraction failed: {e}")
         # Fallback
-        txt = _clean_text(pdf_page.get_text("text") or "")
-        if not _is_meaningful_text(txt):
-            return [], current_section
-        return [
-            TextBlock(
-                id=f"txt_{start_index:04d}",
-                doc_id=doc_id,
-                page=page_number,
-                content=txt,
-                section=current_section,
-                category="fallback",
-                bbox=(0.0,0.0,0.0,0.0),
-                extra={"noise": False, "block_type": "normal", "intent": [], "entities": []}
-            )
-        ], current_section
+        return None, _clean_text(pdf_page.get_text("text") or "")
 
     raw_blocks = page_dict.get("blocks", []) or []
     
@@ -294,37 +318,30 @@ def _extract_text_blocks_from_page(
     # 2. Robust Sort
     raw_blocks = _sort_blocks_reading_order(raw_blocks)
 
-    # 3. Calculate Page Statistics
+    # 3. Calculate Page Statistics + เก็บข้อความ/ขนาด font ของแต่ละ block ไว้เลย (วน spans รอบเดียว)
     font_sizes = []
+    block_spans = []  # (raw block, spans_text, block_fonts) เฉพาะ text block
     for b in raw_blocks:
-        if b.get("type") != 0: continue
-        for line in b.get("lines", []):
-            for span in line.get("spans", []):
-                if span.get("size"): font_sizes.append(span["size"])
-    
-    page_median_font = statistics.median(font_sizes) if font_sizes else 10.0
-
-    text_blocks: List[TextBlock] = []
-    current_index = start_index
-    active_section = current_section
-
-    # --- Phase 1: Extraction & Tagging ---
-    temp_blocks: List[TextBlock] = []
-    
-    for block in raw_blocks:
-        if block.get("type") != 0: continue # Skip images
-
-        # Assemble text
-        lines = block.get("lines", [])
+        if b.get("type") != 0: continue # Skip images
         spans_text = []
         block_fonts = []
-        for line in lines:
+        for line in b.get("lines", []):
             for span in line.get("spans", []):
+                size = span.get("size")
+                if size: font_sizes.append(size)
                 t = span.get("text", "").strip()
                 if t:
                     spans_text.append(t)
-                    block_fonts.append(span.get("size", 0))
-        
+                    block_fonts.append(size or 0)
+        block_spans.append((b, spans_text, block_fonts))
+    
+    # np.median ใช้ partition ใน C (ไม่ต้อง sort ทั้ง list) / float64 ให้ได้ค่าเดียวกับ statistics.median
+    page_median_font = float(np.median(np.asarray(font_sizes, dtype=np.float64))) if font_sizes else 10.0
+
+    # --- Phase 1: Extraction & Tagging (ส่วนที่ไม่ขึ้นกับ section) ---
+    page_blocks: List[dict] = []
+    
+    for block, spans_text, block_fonts in block_spans:
         content = _clean_text(" ".join(spans_text))
         
         # Filter Noise
@@ -342,21 +359,63 @@ def _extract_text_blocks_from_page(
                 is_heading = True
                 heading_level = "H1" if avg_font > page_median_font * 1.5 else "H2"
 
-        # Semantic Analysis
-        block_type = "heading" if is_heading else _detect_block_type(content)
-        
+        x0, y0, x1, y1 = block.get("bbox", (0,0,0,0))
+        page_blocks.append({
+            "content": content,
+            "bbox": (float(x0), float(y0), float(x1), float(y1)),
+            "font_size": avg_font,
+            "is_heading": is_heading,
+            "heading_level": heading_level,
+            # Semantic Analysis
+            "block_type": "heading" if is_heading else _detect_block_type(content),
+        })
+
+    return page_blocks, None
+
+def _build_page_text_blocks(
+    raw_page: RawPage,
+    doc_id: str,
+    page_number: int,
+    start_index: int = 0,
+    current_section: Optional[str] = None
+) -> Tuple[List[TextBlock], Optional[str]]:
+    """ผูก section (ต่อจากหน้าก่อน) + intent/entity ให้ block ของหน้า แล้ว merge"""
+    page_blocks, fallback_text = raw_page
+
+    if page_blocks is None:
+        if not _is_meaningful_text(fallback_text):
+            return [], current_section
+        return [
+            TextBlock(
+                id=f"txt_{start_index:04d}",
+                doc_id=doc_id,
+                page=page_number,
+                content=fallback_text,
+                section=current_section,
+                category="fallback",
+                bbox=(0.0,0.0,0.0,0.0),
+                extra={"noise": False, "block_type": "normal", "intent": [], "entities": []}
+            )
+        ], current_section
+
+    current_index = start_index
+    active_section = current_section
+    temp_blocks: List[TextBlock] = []
+
+    for raw in page_blocks:
+        content = raw["content"]
+        block_type = raw["block_type"]
+
         # Section Propagation
-        if is_heading:
+        if raw["is_heading"]:
             normalized_header = _normalize_section_title(content)
             if normalized_header: active_section = normalized_header
 
         # Rich Metadata Extraction (Intent, Entities, Scope)
-        intents = _analyze_intent(content, active_section)
-        entities = _extract_entities(content)
+        intents, entities = _analyze_keywords(content, active_section)
         answer_scope = _determine_answer_scope(block_type)
 
         current_index += 1
-        x0, y0, x1, y1 = block.get("bbox", (0,0,0,0))
         
         tb = TextBlock(
             id=f"txt_{current_index:04d}",
@@ -365,11 +424,11 @@ def _extract_text_blocks_from_page(
             content=content,
             section=active_section,
             category=None,
-            bbox=(float(x0), float(y0), float(x1), float(y1)),
+            bbox=raw["bbox"],
             extra={
-                "font_size": avg_font,
-                "is_heading": is_heading,
-                "heading_level": heading_level,
+                "font_size": raw["font_size"],
+                "is_heading": raw["is_heading"],
+                "heading_level": raw["heading_level"],
                 "block_type": block_type,
                 # New Metadata
                 "intent": intents,
@@ -384,6 +443,70 @@ def _extract_text_blocks_from_page(
     
     return merged_blocks, active_section
 
+def _extract_text_blocks_from_page(
+    pdf_page: fitz.Page,
+    doc_id: str,
+    page_number: int,
+    start_index: int = 0,
+    current_section: Optional[str] = None
+) -> Tuple[List[TextBlock], Optional[str]]:
+    raw_page = _extract_raw_page_blocks(pdf_page, page_number)
+    return _build_page_text_blocks(raw_page, doc_id, page_number, start_index, current_section)
+
+def _extract_raw_pages_worker(args: Tuple[str, List[int]]) -> List[RawPage]:
+    """รันใน process ลูก: เปิด PDF เอง (fitz.Document pickle ไม่ได้) แล้วดึง raw blocks ของช่วงหน้าที่ได้รับ"""
+    pdf_path, page_indices = args
+    with fitz.open(pdf_path) as pdf_doc:
+        return [_extract_raw_page_blocks(pdf_doc[i], i + 1) for i in page_indices]
+
+def _extract_raw_pages(pdf_doc: fitz.Document, pdf_path: Path, num_workers: int) -> List[RawPage]:
+    """
+    ดึง raw blocks ทุกหน้า (เรียงตามหน้า)
+    - เอกสารยาวและ num_workers > 1 → แบ่งหน้าเป็นช่วงต่อเนื่องกระจายไปหลาย process (งานนี้ CPU-bound ติด GIL)
+    - ถ้า process pool มีปัญหา จะถอยกลับมาทำทีละหน้าใน process นี้
+    """
+    page_count = pdf_doc.page_count
+    if num_workers > 1 and page_count >= _PARALLEL_MIN_PAGES:
+        chunk_size = -(-page_count // num_workers)
+        chunks = [list(range(i, min(i + chunk_size, page_count))) for i in range(0, page_count, chunk_size)]
+        try:
+            with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+                results = executor.map(_extract_raw_pages_worker, [(str(pdf_path), c) for c in chunks])
+                return [raw_page for chunk_result in results for raw_page in chunk_result]
+        except Exception as e:
+            logger.warning(f"[pdf_parser] Parallel page extraction failed ({e}), falling back to sequential.")
+
+    return [_extract_raw_page_blocks(pdf_doc[i], i + 1) for i in range(page_count)]
+
+
+# ==============================================================================
+# [CRITICAL FIX] Correct Import for backend/services/vector_store.py
+# import ตอนจะ embed ตารางจริงเท่านั้น (vector_store ดึง chromadb/embedding model มาด้วย ช้าหลายวินาที
+# และ process ลูกที่ดึงข้อความรายหน้าไม่ต้องใช้)
+# ==============================================================================
+def _import_get_vector_store():
+    try:
+        # 1. ลอง Import ตาม Path ที่ถูกต้อง: backend.services.vector_store
+        from backend.services.vector_store import get_vector_store
+    except ImportError:
+        # 2. ถ้าไม่เจอ (อาจเพราะรัน script แล้ว python path ไม่ถึง root)
+        # ให้ถอยกลับไปหา Root Folder (AI_Data_Ingestion) แล้ว Add เข้า sys.path
+        current_file = Path(__file__).resolve()
+        # ingestion/pdf_parser.py -> parent=ingestion -> parent=AI_Data_Ingestion (Root)
+        project_root = current_file.parents[1]
+        try:
+            if str(project_root) not in sys.path:
+                sys.path.append(str(project_root))
+                
+            from backend.services.vector_store import get_vector_store
+        except ImportError as e:
+            raise ImportError(
+                f"CRITICAL ERROR: ไม่สามารถ Import 'backend.services.vector_store' ได้\n"
+                f"ตำแหน่งไฟล์ที่คาดหวัง: {project_root / 'backend/services/vector_store.py'}\n"
+                f"Error details: {e}"
+            )
+    return get_vector_store
+
 
 # -------------------------------------------------------------------
 # Main Parse Function
@@ -393,7 +516,14 @@ def parse_pdf(
     doc_type: str = "generic",
     doc_id: Optional[str] = None,
     source: str = "uploaded",
+    num_workers: Optional[int] = None,
 ) -> IngestedDocument:
+    """
+    num_workers: จำนวน process ที่ใช้ดึงข้อความต่อหน้า (None = min(cpu, 4), 1 = ไม่แยก process)
+    """
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, 4)
+
     path = Path(file_path)
     if not path.exists():
         raise FileNotFoundError(f"PDF file not found: {path}")
@@ -418,11 +548,12 @@ def parse_pdf(
         current_index = 0
         current_active_section = None
 
-        for page_index in range(pdf_doc.page_count):
-            page = pdf_doc[page_index]
-            
-            page_blocks, next_section = _extract_text_blocks_from_page(
-                pdf_page=page,
+        # ดึง raw blocks ทุกหน้า (ขนานได้) แล้วค่อยไล่ผูก section ต่อกันทีละหน้าตามลำดับ
+        raw_pages = _extract_raw_pages(pdf_doc, path, num_workers)
+
+        for page_index, raw_page in enumerate(raw_pages):
+            page_blocks, next_section = _build_page_text_blocks(
+                raw_page,
                 doc_id=doc_id,
                 page_number=page_index + 1,
                 start_index=current_index,
@@ -448,29 +579,30 @@ def parse_pdf(
         if extracted_tables:
             logger.info(f"[pdf_parser] Found {len(extracted_tables)} tables. Embedding into Vector Store...")
             try:
-                # เรียกใช้ get_vector_store ผ่าน global variable ที่เราเตรียมไว้
+                get_vector_store = _import_get_vector_store()
                 vs = get_vector_store()
                 
+                # รวมทุกตารางเป็น add_texts ครั้งเดียว (embed เป็น batch + เขียน DB รอบเดียว แทนทีละตาราง)
+                texts: List[str] = []
+                metadatas: List[dict] = []
+                ids: List[str] = []
                 for table in extracted_tables:
                     # 1. แปลง Table Object เป็น Text String (พร้อม Summary & Columns)
-                    text = table_to_text(table)
+                    texts.append(table_to_text(table))
                     
                     # 2. เตรียม Metadata ที่ใช้สำหรับ Filter ใน rag.py
-                    metadata_dict = {
+                    metadatas.append({
                         "doc_id": table.doc_id,
                         "page": table.page,
                         "source": "table",       # สำคัญ: เพื่อให้ rag.py รู้ว่าเป็น table
                         "category": table.category, # ใช้สำหรับ Filter ประเภทตาราง
                         "table_id": table.id,
                         "doc_type": doc_type
-                    }
-                    
-                    # 3. Add to Vector Store (ใช้ add_texts)
-                    vs.add_texts(
-                        texts=[text],
-                        metadatas=[metadata_dict],
-                        ids=[f"{table.doc_id}_{table.id}"]
-                    )
+                    })
+                    ids.append(f"{table.doc_id}_{table.id}")
+                
+                # 3. Add to Vector Store (ใช้ add_texts)
+                vs.add_texts(texts=texts, metadatas=metadatas, ids=ids)
             except Exception as e:
                 logger.error(f"[pdf_parser] Failed to embed tables: {e}")
 
@@ -494,4 +626,4 @@ if __name__ == "__main__":
 
     doc = parse_pdf(args.pdf_path)
     # Print sample output with new metadata
-    print(json.dumps([b.dict() for b in doc.texts[:5]], ensure_ascii=False, indent=2))
\ No newline at end of file
+    print(json.dumps([b.to_dict() for b in doc.texts[:5]], ensure_ascii=False, indent=2))
\ No newline at end of file
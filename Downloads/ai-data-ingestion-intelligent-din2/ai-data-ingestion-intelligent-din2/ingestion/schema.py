@@ -1,8 +1,14 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, asdict, field
+import json
+from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional, Tuple, Type, TypeVar, Union
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # optional: fall back to the stdlib json module
+
 # =============================================================================
 # GLOBAL TYPES & HELPERS
 # =============================================================================
@@ -79,7 +85,15 @@ class DocumentMetadata:
     source: str = "uploaded"       # e.g., "uploaded", "api", "scanner"
 
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        # All fields are scalars: build the dict directly instead of asdict()'s recursive deep copy.
+        return {
+            "doc_id": self.doc_id,
+            "file_name": self.file_name,
+            "doc_type": self.doc_type,
+            "page_count": self.page_count,
+            "ingested_at": self.ingested_at,
+            "source": self.source,
+        }
 
     @classmethod
     def from_dict(cls: Type["DocumentMetadata"], data: Dict[str, Any]) -> "DocumentMetadata":
@@ -114,7 +128,22 @@ class TextBlock:
     extra: Dict[str, Any] = field(default_factory=dict)
 
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        """
+        Flat serialization (hot path: called for every block of every document).
+        Only `extra` is copied (shallow); nested values inside it are shared with the block,
+        so callers that mutate those must copy them first.
+        """
+        return {
+            "id": self.id,
+            "doc_id": self.doc_id,
+            "page": self.page,
+            "content": self.content,
+            "section": self.section,
+            "category": self.category,
+            "role": self.role,
+            "bbox": self.bbox,
+            "extra": dict(self.extra),
+        }
 
     @classmethod
     def from_dict(cls: Type["TextBlock"], data: Dict[str, Any]) -> "TextBlock":
@@ -136,7 +165,18 @@ class TextBlock:
 # TableBlock
 # =============================================================================
 
-@dataclass
+# Known TableBlock keys to exclude from extra in from_dict (including properties/aliases)
+_TABLE_KNOWN_FIELDS = frozenset({
+    "id", "doc_id", "page", 
+    "name", "section", "category", "role",
+    "columns", "rows", "header",
+    "markdown", "html_content", 
+    "source", "method", "numeric_trust",
+    "structured_available", "raw_available", "structure_lossy",
+    "bbox", "extra"
+})
+
+@dataclass(slots=True)
 class TableBlock:
     """
     Represents a table extracted from the document.
@@ -199,10 +239,32 @@ class TableBlock:
     def to_dict(self) -> Dict[str, Any]:
         """
         Serializes to dictionary. 
-        Note: Properties (like header) are not included by asdict, 
+        Note: Properties (like header) are not included, 
         but 'columns' is included, which preserves the data.
+        Built directly instead of asdict(): containers are copied one level deep
+        (cells and nested values inside `extra` are shared with the block).
         """
-        return asdict(self)
+        return {
+            "id": self.id,
+            "doc_id": self.doc_id,
+            "page": self.page,
+            "name": self.name,
+            "section": self.section,
+            "category": self.category,
+            "role": self.role,
+            "columns": list(self.columns),
+            "rows": [list(r) for r in self.rows],
+            "markdown": self.markdown,
+            "html_content": self.html_content,
+            "source": self.source,
+            "method": self.method,
+            "numeric_trust": self.numeric_trust,
+            "structured_available": self.structured_available,
+            "raw_available": self.raw_available,
+            "structure_lossy": self.structure_lossy,
+            "bbox": self.bbox,
+            "extra": dict(self.extra),
+        }
 
     @classmethod
     def from_dict(cls: Type["TableBlock"], data: Dict[str, Any]) -> "TableBlock":
@@ -217,21 +279,10 @@ class TableBlock:
         # This ensures fields like 'summary', 'html', 'markdown_content' from extractors 
         # are preserved in extra if not explicitly mapped.
         extra_data = _safe_dict(d.get("extra")).copy()
-        
-        # Define known fields to exclude from extra (including properties/aliases)
-        known_fields = {
-            "id", "doc_id", "page", 
-            "name", "section", "category", "role",
-            "columns", "rows", "header",
-            "markdown", "html_content", 
-            "source", "method", "numeric_trust",
-            "structured_available", "raw_available", "structure_lossy",
-            "bbox", "extra"
-        }
 
         # Collect unexpected fields into extra
         for k, v in d.items():
-            if k not in known_fields:
+            if k not in _TABLE_KNOWN_FIELDS:
                 extra_data[k] = v
 
         # 2. Handle Header/Column Compatibility
@@ -335,7 +386,7 @@ class TableBlock:
 # ImageBlock
 # =============================================================================
 
-@dataclass
+@dataclass(slots=True)
 class ImageBlock:
     """
     Represents an image extracted from the document.
@@ -361,7 +412,19 @@ class ImageBlock:
         self.file_path = value
 
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        # Flat serialization like TextBlock.to_dict (only `extra` is copied, shallowly)
+        return {
+            "id": self.id,
+            "doc_id": self.doc_id,
+            "page": self.page,
+            "file_path": self.file_path,
+            "caption": self.caption,
+            "section": self.section,
+            "category": self.category,
+            "role": self.role,
+            "bbox": self.bbox,
+            "extra": dict(self.extra),
+        }
 
     @classmethod
     def from_dict(cls: Type["ImageBlock"], data: Dict[str, Any]) -> "ImageBlock":
@@ -390,7 +453,7 @@ class ImageBlock:
 
 TIngested = TypeVar("TIngested", bound="IngestedDocument")
 
-@dataclass
+@dataclass(slots=True)
 class IngestedDocument:
     """
     Root container for a fully processed document.
@@ -428,4 +491,36 @@ class IngestedDocument:
             tables=[TableBlock.from_dict(tb) for tb in tables_raw],
             images=[ImageBlock.from_dict(im) for im in images_raw],
             schema_version=version,
-        )
\ No newline at end of file
+        )
+
+
+# =============================================================================
+# JSON BOUNDARY
+# =============================================================================
+
+def dumps(data: Any, indent: bool = False) -> bytes:
+    """
+    Serialize a schema object (anything with ``to_dict``) or plain JSON data
+    to UTF-8 bytes. Uses orjson when installed, otherwise stdlib json with
+    non-ASCII text kept as-is. ``indent=True`` pretty-prints with 2 spaces.
+    """
+    if hasattr(data, "to_dict"):
+        data = data.to_dict()
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON bytes/str produced by ``dumps`` (or any JSON file)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def loads_document(data: Union[bytes, str]) -> IngestedDocument:
+    """Inverse of ``dumps(doc)``: parse JSON and rebuild an IngestedDocument."""
+    return IngestedDocument.from_dict(loads(data))
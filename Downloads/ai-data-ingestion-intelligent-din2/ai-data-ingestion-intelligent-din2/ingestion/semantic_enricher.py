@@ -15,53 +15,153 @@ semantic_enricher.py
 - ใช้ LLM (Custom API/Qwen) ช่วย (ถ้ามี KEY)
 """
 
-from typing import List, Dict, Any, Optional
-from dotenv import load_dotenv
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+import asyncio
 import os
-
-load_dotenv()
 import re
 
-# [CHANGE] ใช้ OpenAI Client สำหรับ Custom API
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
-
 from .schema import IngestedDocument, TextBlock, TableBlock
 
+# openai / dotenv import ช้า และโหมด rule-based (กรณีส่วนใหญ่) ไม่ได้ใช้ -> import ตอนจะเรียก LLM จริงเท่านั้น
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 # ---------------------------
 # [CHANGE] Model Config
 # ---------------------------
 # ใช้ Qwen 72B ซึ่งฉลาดที่สุดในลิสต์สำหรับการเข้าใจบริบท
-LLM_MODEL = os.getenv("CUSTOM_MODEL_NAME", "qwen/qwen-2.5-72b-instruct")
+LLM_DEFAULT_MODEL = "qwen/qwen-2.5-72b-instruct"
+
+# ส่งให้ LLM tag เฉพาะ block แรก ๆ เท่านี้ (ที่เหลือใช้ rule-based)
+LLM_TAG_MAX_BLOCKS = 200
+# แบ่ง block เป็น chunk ละเท่านี้แล้วยิงพร้อมกัน แทน prompt ก้อนเดียว 200 block ที่ต้องรอ completion ยาว ๆ
+LLM_TAG_CHUNK_SIZE = 40
+LLM_TAG_CONCURRENCY = 8
+# ตัดข้อความแต่ละ block ไม่เกินเท่านี้ตัวอักษร กัน block ยาวผิดปกติก้อนเดียวกิน token ของทั้ง chunk
+LLM_TAG_MAX_CHARS = 300
+
+
+@lru_cache(maxsize=1)
+def _ensure_dotenv() -> None:
+    """โหลด .env ครั้งเดียวต่อ process (เรียกเฉพาะตอนใช้ LLM)"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
 
+@lru_cache(maxsize=1)
+def _get_llm_model() -> str:
+    _ensure_dotenv()
+    return os.getenv("CUSTOM_MODEL_NAME", LLM_DEFAULT_MODEL)
 
-def _get_llm_client() -> Optional[OpenAI]:
+
+@lru_cache(maxsize=1)
+def _get_llm_credentials() -> Optional[Tuple[str, Optional[str]]]:
     """
-    คืน OpenAI Client สำหรับ Custom API ถ้ามี Key
+    อ่าน Key/Base URL ของ Custom API ครั้งเดียวต่อ process (เปลี่ยน .env แล้วต้อง restart)
     """
+    _ensure_dotenv()
     api_key = os.getenv("CUSTOM_API_KEY")
     base_url = os.getenv("CUSTOM_API_BASE")
     
     if api_key:
         print(f"[DEBUG semantic_enricher] Custom API Key found: {api_key[:5]}...")
-    else:
-        print("[DEBUG semantic_enricher] No CUSTOM_API_KEY found.")
+        return api_key, base_url
+
+    print("[DEBUG semantic_enricher] No CUSTOM_API_KEY found.")
+    return None
+
+
+def _get_llm_client() -> Optional[AsyncOpenAI]:
+    """
+    คืน OpenAI Client (async) สำหรับ Custom API ถ้ามี Key
+    - สร้างใหม่ทุกรอบ asyncio.run: connection pool ของ AsyncOpenAI ผูกกับ event loop ที่สร้างมัน
+      ใช้ข้าม loop ไม่ได้ (ภายในรอบเดียวทุก chunk ใช้ connection ร่วมกันอยู่แล้ว)
+    """
+    credentials = _get_llm_credentials()
+    if credentials is None:
         return None
+    api_key, base_url = credentials
 
     try:
-        return OpenAI(api_key=api_key, base_url=base_url)
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key=api_key, base_url=base_url)
     except Exception as e:
         print("[semantic_enricher] Cannot init OpenAI Client:", e)
         return None
 
 
+def _parse_label_lines(resp_text: str, valid_labels: frozenset) -> Dict[int, str]:
+    """แปลงคำตอบ LLM รูปแบบ `index: label` ทีละบรรทัด → {index: label} (label นอกลิสต์ → other)"""
+    mapping: Dict[int, str] = {}
+    for line in resp_text.splitlines():
+        idx_str, sep, label = line.partition(":")
+        if not sep:
+            continue
+        idx_str = idx_str.strip().strip("[]")
+        label = label.strip().lower()
+        try:
+            idx = int(idx_str)
+        except ValueError:
+            continue
+        if label not in valid_labels:
+            label = "other"
+        mapping[idx] = label
+    return mapping
+
+
+async def _llm_label_blocks(
+    client: AsyncOpenAI,
+    lines: List[str],
+    build_prompt,
+    valid_labels: frozenset,
+    task_name: str,
+) -> Dict[int, str]:
+    """
+    ให้ LLM ติด label ทีละ chunk (LLM_TAG_CHUNK_SIZE บรรทัด) พร้อมกันไม่เกิน LLM_TAG_CONCURRENCY request
+    - lines มี index ของ block ทั้งเอกสารอยู่แล้ว ("[i] ...") จึงรวม mapping ของทุก chunk ได้ตรง ๆ
+    - chunk ไหนพัง block ใน chunk นั้นจะไปใช้ rule-based แทน (ไม่ล้มทั้งเอกสาร)
+    """
+    semaphore = asyncio.Semaphore(LLM_TAG_CONCURRENCY)
+
+    async def _label_chunk(chunk: List[str]) -> Dict[int, str]:
+        async with semaphore:
+            try:
+                response = await client.chat.completions.create(
+                    model=_get_llm_model(),
+                    messages=[
+                        {"role": "system", "content": "You are a helpful document analyzer."},
+                        {"role": "user", "content": build_prompt("\n".join(chunk))}
+                    ],
+                    temperature=0.0,
+                    max_tokens=2000
+                )
+            except Exception as e:
+                print(f"[semantic_enricher] LLM {task_name} chunk failed:", e)
+                return {}
+        return _parse_label_lines(response.choices[0].message.content or "", valid_labels)
+
+    chunks = [lines[i:i + LLM_TAG_CHUNK_SIZE] for i in range(0, len(lines), LLM_TAG_CHUNK_SIZE)]
+    try:
+        results = await asyncio.gather(*(_label_chunk(c) for c in chunks))
+    finally:
+        await client.close()
+
+    mapping: Dict[int, str] = {}
+    for chunk_mapping in results:
+        mapping.update(chunk_mapping)
+    return mapping
+
+
 # ===========================
 # 1) SECTION TAGGING
 # ===========================
 
 SECTION_LABELS = ["header", "summary", "transactions", "footer", "qna", "other"]
+# ใช้เช็ก label ที่ LLM ตอบกลับ (list ด้านบนเก็บไว้ใส่ใน prompt ตามลำดับเดิม)
+_SECTION_LABEL_SET = frozenset(SECTION_LABELS)
 
 _QNA_HINTS = [
     "ถาม:",
@@ -73,9 +173,40 @@ _QNA_HINTS = [
 ]
 
 
+def _keyword_re(keywords: List[str]) -> re.Pattern:
+    """รวม keyword หลายคำเป็น regex เดียว (สแกนข้อความรอบเดียวแทน `k in text` ทีละคำ)"""
+    return re.compile("|".join(map(re.escape, keywords)))
+
+
+_QNA_HINTS_RE = _keyword_re(_QNA_HINTS)
+
+# keyword ของ rule-based section (เทียบกับข้อความตัวพิมพ์เล็ก)
+_SECTION_SUMMARY_RE = _keyword_re(["summary", "สรุป", "overview", "executive summary", "สรุปยอด"])
+_SECTION_TX_RE = _keyword_re([
+    "รายการเดินบัญชี", "statement of account", "movement",
+    "รายการ", "รายละเอียดบัญชี", "statement", "transactions",
+])
+_SECTION_FOOTER_RE = _keyword_re(["ลงชื่อ", "ผู้มีอำนาจลงนาม", "ขอแสดงความนับถือ", "signature"])
+
+
+# ขนาดพอให้ทั้งเอกสารใหญ่ ๆ อยู่ใน cache ระหว่าง tag_sections -> categorize_text_blocks
+# (ถ้าเล็กกว่าจำนวน block, LRU ที่ไล่อ่านตามลำดับจะ miss ทุกตัวใน pass ถัดไป)
+_TEXT_FEATURE_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=_TEXT_FEATURE_CACHE_SIZE)
+def _text_features(content: str) -> Tuple[str, str, str]:
+    """
+    content → (strip แล้ว, ตัวพิมพ์เล็ก, ตัด space ออก)
+    ทุก pass (section / role / qna) ใช้ชุดเดียวกัน ไม่ต้อง strip/lower/replace ซ้ำทุก pass
+    """
+    txt = content.strip()
+    return txt, txt.lower(), txt.replace(" ", "")
+
+
 def _looks_like_qna(text: str) -> bool:
-    t = text.replace(" ", "")
-    return any(h in t for h in _QNA_HINTS)
+    _, _, t = _text_features(text)
+    return _QNA_HINTS_RE.search(t) is not None
 
 
 def _guess_section_rule(block: TextBlock, index: int, total: int) -> str:
@@ -84,15 +215,15 @@ def _guess_section_rule(block: TextBlock, index: int, total: int) -> str:
     - ใช้ is_heading จาก pdf_parser ถ้ามี
     - ใช้ pattern ภาษาไทย/อังกฤษ ทั่วไป
     """
-    txt = (block.content or "").strip()
-    lower = txt.lower()
+    content = block.content or ""
+    txt, lower, _ = _text_features(content)
     extra = block.extra or {}
 
     is_heading = bool(extra.get("is_heading"))
     page = getattr(block, "page", None) or 0
 
     # 1) Q&A document section
-    if _looks_like_qna(txt):
+    if _looks_like_qna(content):
         return "qna"
 
     # 2) header: หัวเรื่องใหญ่ต้นเอกสาร
@@ -102,41 +233,22 @@ def _guess_section_rule(block: TextBlock, index: int, total: int) -> str:
         return "header"
 
     # 3) summary
-    if any(k in lower for k in ["summary", "สรุป", "overview", "executive summary", "สรุปยอด"]):
+    if _SECTION_SUMMARY_RE.search(lower):
         return "summary"
 
     # 4) transaction-like
-    if any(k in lower for k in ["รายการเดินบัญชี", "statement of account", "movement"]):
-        return "transactions"
-    if any(k in lower for k in ["รายการ", "รายละเอียดบัญชี", "statement", "transactions"]):
+    if _SECTION_TX_RE.search(lower):
         return "transactions"
 
     # 5) footer
-    if any(k in lower for k in ["ลงชื่อ", "ผู้มีอำนาจลงนาม", "ขอแสดงความนับถือ", "signature"]):
+    if _SECTION_FOOTER_RE.search(lower):
         return "footer"
 
     return "other"
 
 
-def tag_sections(
-    doc: IngestedDocument,
-    use_llm: bool = False,
-) -> IngestedDocument:
-    """
-    ใส่ section label ลงใน TextBlock.extra["section"]
-    ถ้า use_llm=True + มี KEY → ใช้ LLM ช่วย
-    ถ้า error หรือไม่มี KEY → fallback เป็น rule-based (_guess_section_rule)
-    """
-    client = _get_llm_client() if use_llm else None
-
-    if client:
-        # ทำทีละก้อนใหญ่ ให้โมเดลช่วย tag section เฉพาะบาง block แรก
-        joined = []
-        for i, b in enumerate(doc.texts):
-            joined.append(f"[{i}] {b.content}")
-        prompt_text = "\n".join(joined[:200])  # limit 200 blocks แรก
-
-        prompt = f"""
+def _build_section_prompt(prompt_text: str) -> str:
+    return f"""
 You are a document segmenter.
 
 For each numbered text block below, assign ONE section label from:
@@ -156,42 +268,41 @@ Text blocks:
 {prompt_text}
 """
 
+
+def tag_sections(
+    doc: IngestedDocument,
+    use_llm: bool = False,
+) -> IngestedDocument:
+    """
+    ใส่ section label ลงใน TextBlock.extra["section"]
+    ถ้า use_llm=True + มี KEY → ใช้ LLM ช่วย
+    ถ้า error หรือไม่มี KEY → fallback เป็น rule-based (_guess_section_rule)
+    """
+    client = _get_llm_client() if use_llm else None
+
+    if client:
+        # ให้โมเดลช่วย tag section เฉพาะบาง block แรก (แบ่ง chunk ยิงพร้อมกัน)
+        # block ว่างไม่ส่งไป (ไม่มี label ใน mapping -> ใช้ rule-based)
+        lines = [
+            f"[{i}] {txt[:LLM_TAG_MAX_CHARS]}"
+            for i, b in enumerate(doc.texts[:LLM_TAG_MAX_BLOCKS])
+            if (txt := (b.content or "").strip())
+        ]
+
         try:
-            # [CHANGE] ใช้ Chat Completion API
-            response = client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a helpful document analyzer."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.0,
-                max_tokens=2000
+            mapping = asyncio.run(
+                _llm_label_blocks(client, lines, _build_section_prompt, _SECTION_LABEL_SET, "section tagging")
             )
-            
-            resp_text = response.choices[0].message.content or ""
-            
-            mapping: Dict[int, str] = {}
-            for line in resp_text.splitlines():
-                line = line.strip()
-                if not line or ":" not in line:
-                    continue
-                idx_str, label = line.split(":", 1)
-                idx_str = idx_str.strip().strip("[]")
-                label = label.strip().lower()
-                try:
-                    idx = int(idx_str)
-                except ValueError:
-                    continue
-                if label not in SECTION_LABELS:
-                    label = "other"
-                mapping[idx] = label
 
             # apply mapping + fallback rule-based ที่ไม่มีใน mapping
             total = len(doc.texts)
             for i, b in enumerate(doc.texts):
-                extra = dict(b.extra or {})
-                extra["section"] = mapping.get(i, _guess_section_rule(b, i, total))
-                b.extra = extra
+                label = mapping.get(i)
+                if label is None:
+                    label = _guess_section_rule(b, i, total)
+                if b.extra is None:
+                    b.extra = {}
+                b.extra["section"] = label
 
             return doc
 
@@ -202,9 +313,10 @@ Text blocks:
     # fallback: rule-based ทั้งหมด
     total = len(doc.texts)
     for i, b in enumerate(doc.texts):
-        extra = dict(b.extra or {})
-        extra["section"] = _guess_section_rule(b, i, total)
-        b.extra = extra
+        label = _guess_section_rule(b, i, total)
+        if b.extra is None:
+            b.extra = {}
+        b.extra["section"] = label
 
     return doc
 
@@ -224,18 +336,27 @@ TEXT_ROLE_LABELS = [
     "qna_answer",           # คำตอบ/เฉลย (ตอบ:, เฉลย)
     "other",
 ]
+_TEXT_ROLE_LABEL_SET = frozenset(TEXT_ROLE_LABELS)
+
+# keyword ของ rule-based role (เทียบกับข้อความตัวพิมพ์เล็ก)
+_ROLE_TITLE_RE = _keyword_re(["statement", "รายงาน", "account statement"])
+_ROLE_ACCOUNT_RE = _keyword_re(["เลขที่บัญชี", "account no", "account number", "branch", "ธนาคาร", "bank"])
+_ROLE_TX_HEADER_RE = _keyword_re([
+    "วันที่", "วันเดือนปี", "transaction", "ยอดคงเหลือ", "จำนวนเงิน", "amount", "credit", "debit",
+])
+_ROLE_NOTE_RE = _keyword_re(["หมายเหตุ", "note:", "หมาย เหตุ", "remark"])
+_ROLE_FOOTER_RE = _keyword_re(["ลงชื่อ", "ผู้มีอำนาจลงนาม", "ขอแสดงความนับถือ"])
+_NUMBERED_ITEM_RE = re.compile(r"^\s*\d+[\).]")
 
 
 def _guess_text_role_rule(block: TextBlock) -> str:
-    txt = (block.content or "").strip()
-    lower = txt.lower()
+    txt, lower, t_no_space = _text_features(block.content or "")
     extra = block.extra or {}
     section = extra.get("section")
 
     is_heading = extra.get("is_heading", False)
 
     # Q&A roles
-    t_no_space = txt.replace(" ", "")
     if t_no_space.startswith("ถาม:") or "คำถาม" in txt or "question" in lower:
         return "qna_question"
     if t_no_space.startswith("ตอบ:") or "เฉลย" in txt or "answer" in lower:
@@ -244,23 +365,23 @@ def _guess_text_role_rule(block: TextBlock) -> str:
     # title: หัวเรื่องใหญ่
     if section == "header" and (is_heading or len(txt) < 120):
         return "title"
-    if len(txt) < 80 and any(k in lower for k in ["statement", "รายงาน", "account statement"]):
+    if len(txt) < 80 and _ROLE_TITLE_RE.search(lower):
         return "title"
 
     # account info
-    if any(k in lower for k in ["เลขที่บัญชี", "account no", "account number", "branch", "ธนาคาร", "bank"]):
+    if _ROLE_ACCOUNT_RE.search(lower):
         return "account_info"
 
     # transaction header
-    if any(k in lower for k in ["วันที่", "วันเดือนปี", "transaction", "ยอดคงเหลือ", "จำนวนเงิน", "amount", "credit", "debit"]):
+    if _ROLE_TX_HEADER_RE.search(lower):
         return "transaction_header"
 
     # note
-    if any(k in lower for k in ["หมายเหตุ", "note:", "หมาย เหตุ", "remark"]):
+    if _ROLE_NOTE_RE.search(lower):
         return "note"
 
     # footer
-    if any(k in lower for k in ["ลงชื่อ", "ผู้มีอำนาจลงนาม", "ขอแสดงความนับถือ"]):
+    if _ROLE_FOOTER_RE.search(lower):
         return "footer_text"
 
     # transaction_row heuristic
@@ -270,39 +391,14 @@ def _guess_text_role_rule(block: TextBlock) -> str:
     # qna section butไม่ได้ match patternชัดเจน
     if section == "qna" and len(txt) > 5:
         # ถ้ามี ? หรือ ตัวเลขนำหน้า + จุด → น่าจะเป็นคำถาม
-        if "?" in txt or re.match(r"^\s*\d+[\).]", txt):
+        if "?" in txt or _NUMBERED_ITEM_RE.match(txt):
             return "qna_question"
 
     return "other"
 
 
-def categorize_text_blocks(
-    doc: IngestedDocument,
-    use_llm: bool = False,
-) -> IngestedDocument:
-    """
-    ใส่ role ให้ TextBlock.extra["role"] เช่น:
-    - title
-    - account_info
-    - transaction_header
-    - transaction_row
-    - note
-    - footer_text
-    - qna_question
-    - qna_answer
-    - other
-    """
-    client = _get_llm_client() if use_llm else None
-
-    if client:
-        # ส่งเฉพาะ subset ไปให้โมเดลช่วย classify
-        joined = []
-        for i, b in enumerate(doc.texts[:200]):
-            section = (b.extra or {}).get("section", "unknown")
-            joined.append(f"[{i}] (section={section}) {b.content}")
-        prompt_text = "\n".join(joined)
-
-        prompt = f"""
+def _build_text_role_prompt(prompt_text: str) -> str:
+    return f"""
 You are a document text role classifier for multi-type PDFs
 (e.g. bank statements, financial reports, exam Q&A, manuals).
 
@@ -326,40 +422,45 @@ Text blocks:
 {prompt_text}
 """
 
+
+def categorize_text_blocks(
+    doc: IngestedDocument,
+    use_llm: bool = False,
+) -> IngestedDocument:
+    """
+    ใส่ role ให้ TextBlock.extra["role"] เช่น:
+    - title
+    - account_info
+    - transaction_header
+    - transaction_row
+    - note
+    - footer_text
+    - qna_question
+    - qna_answer
+    - other
+    """
+    client = _get_llm_client() if use_llm else None
+
+    if client:
+        # ส่งเฉพาะ subset ไปให้โมเดลช่วย classify (แบ่ง chunk ยิงพร้อมกัน)
+        lines = [
+            f"[{i}] (section={(b.extra or {}).get('section', 'unknown')}) {txt[:LLM_TAG_MAX_CHARS]}"
+            for i, b in enumerate(doc.texts[:LLM_TAG_MAX_BLOCKS])
+            if (txt := (b.content or "").strip())
+        ]
+
         try:
-            # [CHANGE] ใช้ Chat Completion API
-            response = client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a helpful document analyzer."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.0,
-                max_tokens=2000
+            mapping = asyncio.run(
+                _llm_label_blocks(client, lines, _build_text_role_prompt, _TEXT_ROLE_LABEL_SET, "text role tagging")
             )
-            
-            resp_text = response.choices[0].message.content or ""
-            
-            mapping: Dict[int, str] = {}
-            for line in resp_text.splitlines():
-                line = line.strip()
-                if not line or ":" not in line:
-                    continue
-                idx_str, label = line.split(":", 1)
-                idx_str = idx_str.strip().strip("[]")
-                label = label.strip().lower()
-                try:
-                    idx = int(idx_str)
-                except ValueError:
-                    continue
-                if label not in TEXT_ROLE_LABELS:
-                    label = "other"
-                mapping[idx] = label
 
             for i, b in enumerate(doc.texts):
-                extra = dict(b.extra or {})
-                extra["role"] = mapping.get(i, _guess_text_role_rule(b))
-                b.extra = extra
+                label = mapping.get(i)
+                if label is None:
+                    label = _guess_text_role_rule(b)
+                if b.extra is None:
+                    b.extra = {}
+                b.extra["role"] = label
 
             return doc
 
@@ -369,9 +470,10 @@ Text blocks:
 
     # fallback rule-based
     for b in doc.texts:
-        extra = dict(b.extra or {})
-        extra["role"] = _guess_text_role_rule(b)
-        b.extra = extra
+        label = _guess_text_role_rule(b)
+        if b.extra is None:
+            b.extra = {}
+        b.extra["role"] = label
 
     return doc
 
@@ -416,35 +518,55 @@ HEADER_NORMALIZATION_MAP = {
 }
 
 
+def _scan_header_map(h_clean: str) -> Optional[str]:
+    # ลำดับ key ใน map คือ priority: key แรกที่อยู่ใน header ชนะ
+    for key, canonical in HEADER_NORMALIZATION_MAP.items():
+        if key in h_clean:
+            return canonical
+    return None
+
+
+# header ที่ตรงกับ key เป๊ะ ๆ (กรณีส่วนใหญ่) → dict lookup ทีเดียว (ค่าได้จาก scan เดิมเพื่อให้ผลเหมือนกัน)
+_EXACT_HEADERS: Dict[str, str] = {key: _scan_header_map(key) for key in HEADER_NORMALIZATION_MAP}
+_HEADER_KEY_PRIORITY = {key: i for i, key in enumerate(HEADER_NORMALIZATION_MAP)}
+# กรณี "มี key อยู่ในชื่อ" → สแกนรอบเดียว: lookahead ให้เจอ key ที่ซ้อนกันได้
+# เรียง alternation ตาม priority เพื่อให้แต่ละตำแหน่งได้ key ที่ priority สูงสุดที่เริ่มตรงนั้น
+_HEADER_KEYS_RE = re.compile(
+    "(?=(" + "|".join(re.escape(key) for key in HEADER_NORMALIZATION_MAP) + "))"
+)
+
+
 def _normalize_header_name(h: str) -> str:
     """normalize header ชื่อ → canonical name ถ้าเจอ"""
     h_clean = (h or "").strip().lower()
     if not h_clean:
         return ""
-    for key, canonical in HEADER_NORMALIZATION_MAP.items():
-        if key in h_clean:
-            return canonical
-    return h_clean
+    canonical = _EXACT_HEADERS.get(h_clean)
+    if canonical is not None:
+        return canonical
+    hits = [m.group(1) for m in _HEADER_KEYS_RE.finditer(h_clean)]
+    if not hits:
+        return h_clean
+    return HEADER_NORMALIZATION_MAP[min(hits, key=_HEADER_KEY_PRIORITY.__getitem__)]
 
 
 TABLE_ROLE_LABELS = ["transaction_table", "summary_table", "other_table"]
 
 
-def _guess_table_role(tb: TableBlock) -> str:
-    header = getattr(tb, "header", []) or []
-    header_lower = [str(h).lower() for h in header]
-    header_joined = " ".join(header_lower)
+# keyword ของ header ตาราง (เทียบกับ header ตัวพิมพ์เล็ก)
+_TABLE_DATE_RE = _keyword_re(["date", "วันที่"])
+_TABLE_AMOUNT_RE = _keyword_re(["amount", "ยอดเงิน", "debit", "credit", "ยอดคงเหลือ", "balance"])
+_TABLE_SUMMARY_RE = _keyword_re(["summary", "สรุป", "total", "รวม", "สรุปยอด"])
+# cell ที่มีตัวอักษรไทย/อังกฤษ (ใช้เดาว่าแถวแรกเป็น header)
+_HEADER_TEXT_CELL_RE = re.compile(r"[A-Za-z\u0E00-\u0E7F]")
 
-    has_date = any("date" in h or "วันที่" in h for h in header_lower)
-    has_amount = any(
-        any(x in h for x in ["amount", "ยอดเงิน", "debit", "credit", "ยอดคงเหลือ", "balance"])
-        for h in header_lower
-    )
 
+def _table_role(has_date: bool, has_amount: bool, header_lower: List[str]) -> str:
+    """role ของตารางจาก flag date/amount ที่เช็กระหว่าง normalize header (header ตัวพิมพ์เล็กแล้ว)"""
     if has_date and has_amount:
         return "transaction_table"
 
-    if any(k in header_joined for k in ["summary", "สรุป", "total", "รวม", "สรุปยอด"]):
+    if _TABLE_SUMMARY_RE.search(" ".join(header_lower)):
         return "summary_table"
 
     return "other_table"
@@ -464,34 +586,43 @@ def normalize_tables(tables: List[TableBlock]) -> List[TableBlock]:
         header = list(getattr(tb, "header", []) or [])
         rows = list(getattr(tb, "rows", []) or [])
 
+        # block เป็นของเราเอง: แก้ extra ตรง ๆ ไม่ต้อง copy dict ทุกตาราง
+        if tb.extra is None:
+            tb.extra = {}
+        extra = tb.extra
+
         # ถ้า header ว่าง แต่แถวแรกดูเหมือนเป็น header (ไม่ใช่ตัวเลขล้วน ๆ)
         if not header and rows:
             first = rows[0]
-            text_cells = sum(1 for c in first if re.search(r"[A-Za-z\u0E00-\u0E7F]", str(c)))
+            text_cells = sum(1 for c in first if _HEADER_TEXT_CELL_RE.search(str(c)))
             if text_cells >= max(1, len(first) // 2):
                 header = [str(c) for c in first]
                 rows = rows[1:]
-                extra = dict(tb.extra or {})
                 extra["header_inferred"] = True
-                tb.extra = extra
 
-        normalized_header = [_normalize_header_name(h) for h in header]
+        # normalize header + เช็ก keyword สำหรับ role ไปในรอบเดียวกัน (role ดูจาก header ที่ normalize แล้ว)
+        normalized_header: List[str] = []
+        has_date = has_amount = False
+        for h in header:
+            name = _normalize_header_name(h)
+            normalized_header.append(name)
+            if not has_date and _TABLE_DATE_RE.search(name):
+                has_date = True
+            if not has_amount and _TABLE_AMOUNT_RE.search(name):
+                has_amount = True
+
         tb.header = normalized_header
         tb.rows = rows
 
-        extra = dict(tb.extra or {})
-        extra_norm = dict(extra.get("header_normalization", {}))
-        extra_norm.update(
+        extra.setdefault("header_normalization", {}).update(
             {
                 "original_header": header,
                 "normalized_header": normalized_header,
             }
         )
-        extra["header_normalization"] = extra_norm
 
         # ใส่ role ให้ table ด้วย
-        extra["role"] = _guess_table_role(tb)
-        tb.extra = extra
+        extra["role"] = _table_role(has_date, has_amount, normalized_header)
 
     return tables
 
@@ -518,6 +649,10 @@ def _parse_float_safe(val: Optional[str]) -> Optional[float]:
         return None
 
 
+# canonical header ที่ใช้ map เป็น transaction record (ลำดับตรงกับการ unpack ใน extract_transactions_from_table)
+_TRANSACTION_FIELDS = ("date", "description", "amount_in", "amount_out", "amount", "balance")
+
+
 def extract_transactions_from_table(tb: TableBlock) -> List[Dict[str, Any]]:
     """
     พยายาม map ตารางให้กลายเป็น transaction records:
@@ -534,26 +669,24 @@ def extract_transactions_from_table(tb: TableBlock) -> List[Dict[str, Any]]:
             continue
         name_to_idx[h] = i
 
+    # หา index ของแต่ละ field ครั้งเดียวต่อตาราง (ไม่ต้อง lookup header ซ้ำทุกแถว)
+    field_idxs = [name_to_idx.get(name) for name in _TRANSACTION_FIELDS]
+    if all(idx is None for idx in field_idxs):
+        return []
+
     records: List[Dict[str, Any]] = []
 
     for row in rows:
-        def col(name: str) -> Optional[str]:
-            idx = name_to_idx.get(name)
-            if idx is None or idx >= len(row):
-                return None
-            return str(row[idx]).strip()
-
-        date = col("date")
-        desc = col("description")
-
-        amount_in = col("amount_in")
-        amount_out = col("amount_out")
-        amount = col("amount")
-        balance = col("balance")
-
-        if not any([date, desc, amount_in, amount_out, amount, balance]):
+        n_cols = len(row)
+        values = [
+            str(row[idx]).strip() if idx is not None and idx < n_cols else None
+            for idx in field_idxs
+        ]
+        if not any(values):
             continue
 
+        date, desc, amount_in, amount_out, amount, balance = values
+
         record: Dict[str, Any] = {
             "date_raw": date,
             "description": desc,
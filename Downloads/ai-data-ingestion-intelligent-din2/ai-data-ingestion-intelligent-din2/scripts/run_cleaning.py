@@ -10,10 +10,9 @@ run_cleaning.py
 """
 
 import argparse
-import json
 from pathlib import Path
 
-from ingestion.schema import DocumentMetadata, TextBlock, TableBlock, IngestedDocument
+from ingestion.schema import DocumentMetadata, TextBlock, TableBlock, IngestedDocument, dumps, loads
 from ingestion.cleaner import clean_text_blocks, clean_table_blocks
 
 
@@ -33,14 +32,14 @@ def run_cleaning(
     if not text_path.exists():
         raise FileNotFoundError(f"text.json not found for doc_id={doc_id}")
 
-    metadata_dict = json.loads(meta_path.read_text(encoding="utf-8"))
-    text_list = json.loads(text_path.read_text(encoding="utf-8"))
+    metadata_dict = loads(meta_path.read_bytes())
+    text_list = loads(text_path.read_bytes())
 
     meta = DocumentMetadata(**metadata_dict)
     texts = [TextBlock(**t) for t in text_list]
 
     if table_path.exists():
-        table_list = json.loads(table_path.read_text(encoding="utf-8"))
+        table_list = loads(table_path.read_bytes())
         tables = [TableBlock(**tb) for tb in table_list]
     else:
         tables = []
@@ -61,21 +60,8 @@ def run_cleaning(
     text_clean_path = doc_dir / "text_clean.json"
     table_clean_path = doc_dir / "table_clean.json"
 
-    with text_clean_path.open("w", encoding="utf-8") as f:
-        json.dump(
-            [t.to_dict() for t in cleaned_texts],
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
-
-    with table_clean_path.open("w", encoding="utf-8") as f:
-        json.dump(
-            [tb.to_dict() for tb in cleaned_tables],
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
+    text_clean_path.write_bytes(dumps([t.to_dict() for t in cleaned_texts], indent=True))
+    table_clean_path.write_bytes(dumps([tb.to_dict() for tb in cleaned_tables], indent=True))
 
     print(f"[run_cleaning] Saved cleaned texts to:  {text_clean_path}")
     print(f"[run_cleaning] Saved cleaned tables to: {table_clean_path}")
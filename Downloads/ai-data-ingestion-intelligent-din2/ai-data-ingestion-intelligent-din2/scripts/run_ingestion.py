@@ -11,7 +11,7 @@ from pathlib import Path
 from ingestion.pdf_parser import parse_pdf
 from ingestion.table_extractor import extract_tables
 from ingestion.image_extractor import extract_images
-from ingestion.schema import IngestedDocument, TextBlock # <--- เพิ่ม TextBlock
+from ingestion.schema import IngestedDocument, TextBlock, dumps # <--- เพิ่ม TextBlock
 from ingestion.document_classifier import classify_document
 from ingestion.validator import validate_all
 from ingestion.ocr_extractor import ocr_extract_document # <--- เพิ่ม import นี้
@@ -71,17 +71,10 @@ def save_ingested_document(
     doc_dir = output_root / doc_id
     doc_dir.mkdir(parents=True, exist_ok=True)
 
-    with (doc_dir / "metadata.json").open("w", encoding="utf-8") as f:
-        json.dump(doc.metadata.to_dict(), f, ensure_ascii=False, indent=2)
-
-    with (doc_dir / "text.json").open("w", encoding="utf-8") as f:
-        json.dump([t.to_dict() for t in doc.texts], f, ensure_ascii=False, indent=2)
-
-    with (doc_dir / "table.json").open("w", encoding="utf-8") as f:
-        json.dump([tb.to_dict() for tb in doc.tables], f, ensure_ascii=False, indent=2)
-
-    with (doc_dir / "image.json").open("w", encoding="utf-8") as f:
-        json.dump([im.to_dict() for im in doc.images], f, ensure_ascii=False, indent=2)
+    (doc_dir / "metadata.json").write_bytes(dumps(doc.metadata, indent=True))
+    (doc_dir / "text.json").write_bytes(dumps([t.to_dict() for t in doc.texts], indent=True))
+    (doc_dir / "table.json").write_bytes(dumps([tb.to_dict() for tb in doc.tables], indent=True))
+    (doc_dir / "image.json").write_bytes(dumps([im.to_dict() for im in doc.images], indent=True))
         
     print(f"[run_ingestion] Saved output files to: {doc_dir}")
 
@@ -15,10 +15,9 @@ run_semantic_enrich.py
 """
 
 import argparse
-import json
 from pathlib import Path
 
-from ingestion.schema import DocumentMetadata, TextBlock, TableBlock, IngestedDocument
+from ingestion.schema import DocumentMetadata, TextBlock, TableBlock, IngestedDocument, dumps, loads
 from ingestion.semantic_enricher import (
     tag_sections,
     normalize_tables,
@@ -43,13 +42,13 @@ def run_semantic_enrich(
     if not text_clean_path.exists():
         raise FileNotFoundError(f"text_clean.json not found for doc_id={doc_id}. Please run cleaning first.")
 
-    metadata_dict = json.loads(meta_path.read_text(encoding="utf-8"))
-    text_list = json.loads(text_clean_path.read_text(encoding="utf-8"))
+    metadata_dict = loads(meta_path.read_bytes())
+    text_list = loads(text_clean_path.read_bytes())
     meta = DocumentMetadata(**metadata_dict)
     texts = [TextBlock(**t) for t in text_list]
 
     if table_clean_path.exists():
-        table_list = json.loads(table_clean_path.read_text(encoding="utf-8"))
+        table_list = loads(table_clean_path.read_bytes())
         tables = [TableBlock(**tb) for tb in table_list]
     else:
         tables = []
@@ -78,29 +77,10 @@ def run_semantic_enrich(
     table_normalized_path = doc_dir / "table_normalized.json"
     mapping_path = doc_dir / "mapping.json"
 
-    with text_enriched_path.open("w", encoding="utf-8") as f:
-        json.dump(
-            [t.to_dict() for t in doc.texts],
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
-
-    with table_normalized_path.open("w", encoding="utf-8") as f:
-        json.dump(
-            [tb.to_dict() for tb in doc.tables],
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
-
-    with mapping_path.open("w", encoding="utf-8") as f:
-        json.dump(
-            mapping,
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
+    text_enriched_path.write_bytes(dumps([t.to_dict() for t in doc.texts], indent=True))
+    table_normalized_path.write_bytes(dumps([tb.to_dict() for tb in doc.tables], indent=True))
+
+    mapping_path.write_bytes(dumps(mapping, indent=True))
 
     print(f"[run_semantic_enrich] Saved text_enriched to:   {text_enriched_path}")
     print(f"[run_semantic_enrich] Saved table_normalized to: {table_normalized_path}")